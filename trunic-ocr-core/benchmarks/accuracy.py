@@ -0,0 +1,303 @@
+import argparse
+import importlib
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import trunic_ocr_core as ocr
+from ruamel.yaml import YAML
+from trunic_ocr_core import synth
+
+tests_dir = Path(__file__).parent.parent.joinpath("tests")
+REFERENCE_UPSCALE = 3
+
+
+# a configuration takes an image and the lax flag and returns the geometry
+# prim and the recognized glyphs, with origins in the prim's upscaled pixels
+
+
+def run_reference(img, lax):
+    strokes_bordered, prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img, lax=lax)
+    )
+    return prim, list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins))
+
+
+def run_preview(img, lax):
+    strokes_bordered, prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img, lax=lax, preview=True)
+    )
+    return prim, list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins))
+
+
+def run_sampled_estimators(img, lax):
+    # an expired deadline makes detection take its sampled shortcuts
+    strokes_bordered, prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img, lax=lax, deadline=ocr.Deadline(1e-9))
+    )
+    return prim, list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins))
+
+
+def run_slop1(img, lax):
+    strokes_bordered, prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img, lax=lax)
+    )
+    return prim, list(
+        ocr.fitGlyphs(strokes_bordered, geometry, templates, origins, slop=1)
+    )
+
+
+def run_score_maps(img, lax):
+    strokes_bordered, prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img, lax=lax)
+    )
+    score_maps = ocr.prepareScoreMaps(strokes_bordered, geometry, templates)
+    glyphs = []
+    for origin in origins:
+        try:
+            glyphs.append(ocr.fitGlyphAt(score_maps, origin))
+        except ValueError:
+            pass
+    return prim, glyphs
+
+
+def run_upscale2(img, lax):
+    strokes_bordered, prim, geometry, templates, origins, _lines = ocr.run_generator(
+        ocr.find_glyphs_stages(img, 2, lax=lax)
+    )
+    return prim, list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins))
+
+
+CONFIGS = dict(
+    reference=run_reference,
+    preview=run_preview,
+    sampled_estimators=run_sampled_estimators,
+    slop1=run_slop1,
+    score_maps=run_score_maps,
+    upscale2=run_upscale2,
+)
+
+
+def resolve_config(name: str):
+    if name in CONFIGS:
+        return CONFIGS[name]
+    # `module:function` for configurations defined elsewhere
+    module, _, func = name.partition(":")
+    if not func:
+        raise ValueError(f"unknown configuration {name!r}")
+    return getattr(importlib.import_module(module), func)
+
+
+def strokes_int(strokes) -> int:
+    if isinstance(strokes, str):
+        return sum(int(c) << i for i, c in enumerate(strokes))
+    return int(strokes[0]) | int(strokes[1]) << 8
+
+
+def load_golden_corpus(pattern: str):
+    yaml = YAML(typ="safe")
+    for path in sorted(tests_dir.joinpath("goldens").glob(pattern)):
+        golden = yaml.load(path)
+        img_data = tests_dir.joinpath("inputs", golden["input"]["filename"])
+        img = ocr.decodeImage(np.frombuffer(img_data.read_bytes(), dtype=np.uint8))
+        truth = [
+            (tuple(g["origin"]), strokes_int(g["strokes"])) for g in golden["output"]
+        ]
+        # goldens record no geometry; compare against the reference configuration
+        yield path.stem, img, golden["input"]["lax"], truth, None
+
+
+# golden origins are the top-left corner of the glyph template rather than the
+# start of the baseline, as `fitGlyphs` now reports them
+def golden_truth_to_baseline(truth, prim):
+    template_origin = ocr.make_glyph_geometry_from_prim(prim).glyph_template_origin
+    return [(tuple(map(int, np.add(o, template_origin))), s) for o, s in truth]
+
+
+def load_synth_corpus(counts: str):
+    for n in filter(None, counts.split(",")):
+        page = synth.random_page(int(n), seed=int(n), noise=4)
+        truth = [(g["origin"], strokes_int(g["strokes"])) for g in page.glyphs]
+        yield f"synth-{n}", page.image, False, truth, page.geometry_prim
+
+
+def compare_glyphs(truth, found, glyph_width):
+    stats = dict(
+        truth=len(truth),
+        found=len(found),
+        matched=0,
+        exact=0,
+        bit_errors=0,
+        origin_deltas=[],
+    )
+    if not truth or not found:
+        return stats
+    t_origins = np.array([o for o, _s in truth], dtype=np.float64)
+    f_origins = np.array([o for o, _s in found], dtype=np.float64)
+    dist = np.max(np.abs(t_origins[:, None, :] - f_origins[None, :, :]), axis=2)
+    # greedy nearest pairs, closest first
+    taken_t, taken_f = set(), set()
+    for flat in np.argsort(dist, axis=None):
+        ti, fi = np.unravel_index(flat, dist.shape)
+        if dist[ti, fi] > glyph_width / 2:
+            break
+        if ti in taken_t or fi in taken_f:
+            continue
+        taken_t.add(ti)
+        taken_f.add(fi)
+        errors = bin(truth[ti][1] ^ found[fi][1]).count("1")
+        stats["matched"] += 1
+        stats["exact"] += errors == 0
+        stats["bit_errors"] += errors
+        stats["origin_deltas"].append(float(dist[ti, fi]))
+    return stats
+
+
+def prim_deltas(prim, ref_prim):
+    scale = REFERENCE_UPSCALE / prim["upscale"]
+    ref_scale = REFERENCE_UPSCALE / ref_prim["upscale"]
+    return {
+        "size_rel": abs(prim["size"] * scale / (ref_prim["size"] * ref_scale) - 1),
+        "stroke_width": abs(
+            prim["stroke_width"] * scale - ref_prim["stroke_width"] * ref_scale
+        ),
+        "angle": abs(prim["angle"] - ref_prim["angle"]),
+        "upper": abs(prim["upper"] * scale - ref_prim["upper"] * ref_scale),
+        "lower": abs(prim["lower"] * scale - ref_prim["lower"] * ref_scale),
+        "h_nudge": abs(prim["h_nudge"] * scale - ref_prim["h_nudge"] * ref_scale),
+    }
+
+
+def run_config(run, img, lax, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            prim, glyphs = run(img, lax)
+        except Exception as e:
+            return None, None, type(e).__name__
+        times.append(time.perf_counter() - start)
+    # origins in the reference's upscaled pixels
+    scale = REFERENCE_UPSCALE / prim["upscale"]
+    found = [
+        (tuple(np.rint(np.multiply(g["origin"], scale))), strokes_int(g["strokes"]))
+        for g in glyphs
+    ]
+    return (prim, found), statistics.median(times), None
+
+
+def evaluate(configs: list[str], corpus, repeat: int):
+    if "reference" not in configs:
+        configs = ["reference", *configs]
+    rows = {name: dict(cases=dict()) for name in configs}
+    for case, img, lax, truth, truth_prim in corpus:
+        ref_prim = truth_prim
+        for name in configs:
+            result, seconds, error = run_config(resolve_config(name), img, lax, repeat)
+            row = dict(seconds=seconds, error=error)
+            if result is not None:
+                prim, found = result
+                if ref_prim is None:
+                    # reference runs first
+                    ref_prim = prim
+                    truth = golden_truth_to_baseline(truth, prim)
+                glyph_width = (
+                    2 * ref_prim["size"] * np.cos(np.deg2rad(ref_prim["angle"]))
+                )
+                row.update(compare_glyphs(truth, found, glyph_width))
+                row["geometry"] = prim_deltas(prim, ref_prim)
+            rows[name]["cases"][case] = row
+            print(f"{case:16} {name:20} {fmt_case(row)}", file=sys.stderr)
+    for name in configs:
+        rows[name]["summary"] = summarize(
+            rows[name]["cases"], rows["reference"]["cases"]
+        )
+    return rows
+
+
+def summarize(cases, ref_cases):
+    ok = [c for c in cases.values() if c["error"] is None]
+    truth = sum(c["truth"] for c in ok)
+    deltas = [d for c in ok for d in c["origin_deltas"]]
+    both = [
+        k
+        for k, c in cases.items()
+        if c["error"] is None and ref_cases[k]["error"] is None
+    ]
+    seconds = sum(cases[k]["seconds"] for k in both)
+    ref_seconds = sum(ref_cases[k]["seconds"] for k in both)
+    return dict(
+        failures=len(cases) - len(ok),
+        glyphs=truth,
+        missed=sum(c["truth"] - c["matched"] for c in ok),
+        extra=sum(c["found"] - c["matched"] for c in ok),
+        exact_rate=sum(c["exact"] for c in ok) / max(truth, 1),
+        bit_errors=sum(c["bit_errors"] for c in ok),
+        origin_delta_mean=statistics.fmean(deltas) if deltas else 0.0,
+        origin_delta_max=max(deltas, default=0.0),
+        geometry_max={
+            k: max((c["geometry"][k] for c in ok), default=0.0)
+            for k in ("size_rel", "stroke_width", "angle", "upper", "lower", "h_nudge")
+        },
+        seconds=seconds,
+        speedup=ref_seconds / seconds if seconds > 0 else float("nan"),
+    )
+
+
+def fmt_case(row):
+    if row["error"] is not None:
+        return f"failed: {row['error']}"
+    return (
+        f"{row['exact']:>4}/{row['truth']:<4} exact  {row['bit_errors']:>3} bit errors"
+        f"  {row['seconds']:7.3f}s"
+    )
+
+
+def print_summary(rows):
+    print(
+        f"{'config':20} {'fail':>4} {'exact':>7} {'miss':>5} {'extra':>5}"
+        f" {'biterr':>6} {'d_orig':>6} {'d_max':>5} {'d_size':>7} {'d_sw':>5}"
+        f" {'speedup':>7}"
+    )
+    for name, row in rows.items():
+        s = row["summary"]
+        print(
+            f"{name:20} {s['failures']:>4} {s['exact_rate']:>7.2%} {s['missed']:>5}"
+            f" {s['extra']:>5} {s['bit_errors']:>6} {s['origin_delta_mean']:>6.2f}"
+            f" {s['origin_delta_max']:>5.0f} {s['geometry_max']['size_rel']:>7.2%}"
+            f" {s['geometry_max']['stroke_width']:>5.1f} {s['speedup']:>6.2f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="compare pipeline configurations against the goldens and synthetic pages"
+    )
+    parser.add_argument(
+        "configs",
+        nargs="*",
+        default=list(CONFIGS),
+        help=f"names ({', '.join(CONFIGS)}) or module:function",
+    )
+    parser.add_argument("--goldens", default="*.yml", help="glob in tests/goldens")
+    parser.add_argument(
+        "--synth",
+        default="100,400",
+        help="comma separated glyph counts of synthetic pages",
+    )
+    parser.add_argument("-n", "--repeat", type=int, default=1)
+    parser.add_argument("-o", "--output", help="save per-case results as JSON")
+    args = parser.parse_args()
+
+    corpus = [*load_golden_corpus(args.goldens), *load_synth_corpus(args.synth)]
+    rows = evaluate(args.configs, corpus, args.repeat)
+    print_summary(rows)
+    if args.output:
+        Path(args.output).write_text(json.dumps(rows, indent=1))
+
+
+if __name__ == "__main__":
+    main()
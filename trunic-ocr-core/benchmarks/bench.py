@@ -0,0 +1,239 @@
+import argparse
+import json
+import math
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import trunic_ocr_core as ocr
+from trunic_ocr_core import synth
+
+tests_dir = Path(__file__).parent.parent.joinpath("tests")
+
+
+def make_variant(img, variant: str):
+    if variant == "x1":
+        return img
+    if m := re.fullmatch(r"tile(\d+)", variant):
+        n = int(m[1])
+        return np.tile(img, (n, n, 1))
+    if m := re.fullmatch(r"scale(\d+)", variant):
+        n = int(m[1])
+        return cv2.resize(img, None, None, n, n, cv2.INTER_CUBIC)
+    raise ValueError(f"unknown variant {variant!r}")
+
+
+def load_inputs(pattern: str):
+    for path in sorted(tests_dir.joinpath("inputs").glob(pattern)):
+        golden = tests_dir.joinpath("goldens", path.stem + ".yml")
+        lax = golden.exists() and bool(
+            re.search(r"^\s*lax:\s*true\s*$", golden.read_text(), re.M)
+        )
+        img = ocr.decodeImage(np.frombuffer(path.read_bytes(), dtype=np.uint8))
+        yield path.name, img, lax
+
+
+def load_synth(counts: str):
+    for n in filter(None, counts.split(",")):
+        yield f"synth-{n}", synth.random_page(int(n), seed=int(n)).image, False
+
+
+def time_once(img, lax: bool, engine: str):
+    rec = ocr.StageRecorder()
+    start = time.perf_counter()
+    strokes_bordered, _prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img, lax=lax, instrument=rec)
+    )
+    list(
+        ocr.fitGlyphs(
+            strokes_bordered,
+            geometry,
+            templates,
+            origins,
+            instrument=rec,
+            engine=engine,
+        )
+    )
+    total = time.perf_counter() - start
+
+    times = {
+        name: t["wall"]
+        for name, t in rec.to_dict()["totals"].items()
+        if name != "fit_glyph"
+    }
+    times["fit_glyphs"] = rec.to_dict()["totals"].get("fit_glyph", dict(wall=0.0))[
+        "wall"
+    ]
+    times["total"] = total
+    return times, len(origins)
+
+
+def cmd_run(args):
+    cases = dict()
+    inputs = [
+        *(
+            (name, img, lax, args.variants)
+            for name, img, lax in load_inputs(args.inputs)
+        ),
+        *((name, img, lax, "x1") for name, img, lax in load_synth(args.synth)),
+    ]
+    for name, img_orig, lax, variants in inputs:
+        for variant in variants.split(","):
+            img = make_variant(img_orig, variant)
+            key = f"{name}@{variant}"
+            samples: dict[str, list[float]] = dict()
+            glyphs = 0
+            for _ in range(args.repeat):
+                try:
+                    times, glyphs = time_once(img, lax, args.engine)
+                except ocr.GeomNoGoodSpacingException:
+                    print(f"{key}: no good spacing; skipped", file=sys.stderr)
+                    break
+                for stage, t in times.items():
+                    samples.setdefault(stage, []).append(t)
+            if not samples:
+                continue
+            cases[key] = dict(
+                pixels=int(img.shape[0] * img.shape[1]), glyphs=glyphs, samples=samples
+            )
+            print(
+                f"{key:28} {img.shape[1]:>5}x{img.shape[0]:<5} {glyphs:>5} glyphs"
+                f"  total {statistics.median(samples['total']):7.3f}s"
+                f"  fit {statistics.median(samples['fit_glyphs']):7.3f}s",
+                file=sys.stderr,
+            )
+
+    print_scaling(cases)
+    results = dict(
+        meta=dict(
+            date=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            host=platform.node(),
+            machine=platform.machine(),
+            cpus=os.cpu_count(),
+            python=platform.python_version(),
+            numpy=np.__version__,
+            opencv=cv2.__version__,
+            repeat=args.repeat,
+            engine=args.engine,
+        ),
+        cases=cases,
+    )
+    Path(args.output).write_text(json.dumps(results, indent=1))
+
+
+def print_scaling(cases):
+    # how detection cost grows with pixels, and fitting cost with glyphs
+    by_variant: dict[str, list] = dict()
+    for key, case in cases.items():
+        by_variant.setdefault(key.rpartition("@")[2], []).append(case)
+    for variant, vcases in by_variant.items():
+        detect = sum(
+            statistics.median(c["samples"]["total"])
+            - statistics.median(c["samples"]["fit_glyphs"])
+            for c in vcases
+        )
+        fit = sum(statistics.median(c["samples"]["fit_glyphs"]) for c in vcases)
+        pixels = sum(c["pixels"] for c in vcases)
+        glyphs = sum(c["glyphs"] for c in vcases)
+        print(
+            f"{variant:10} detect {detect / pixels * 1e6:7.3f}s/Mpx"
+            f"  fit {fit / max(glyphs, 1) * 1e3:7.3f}ms/glyph",
+            file=sys.stderr,
+        )
+
+
+# one-sided Mann-Whitney U test that `new` tends to be larger than `base`,
+# normal approximation with tie correction
+def mann_whitney_p(base: list[float], new: list[float]) -> float:
+    n1, n2 = len(new), len(base)
+    ranked = sorted([(v, 0) for v in new] + [(v, 1) for v in base])
+    ranks = [0.0] * len(ranked)
+    tie_term = 0.0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        tie_term += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+    u = sum(r for r, (_v, g) in zip(ranks, ranked) if g == 0) - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    var = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if var <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(var)
+    return 1 - statistics.NormalDist().cdf(z)
+
+
+def cmd_compare(args):
+    base = json.loads(Path(args.baseline).read_text())["cases"]
+    new = json.loads(Path(args.results).read_text())["cases"]
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        for stage in sorted(base[key]["samples"].keys() & new[key]["samples"].keys()):
+            b = base[key]["samples"][stage]
+            n = new[key]["samples"][stage]
+            ratio = statistics.median(n) / max(statistics.median(b), 1e-9)
+            p = mann_whitney_p(b, n)
+            if ratio > 1 + args.min_change and p < args.alpha:
+                regressions += 1
+                print(f"REGRESSION {key:28} {stage:20} x{ratio:5.2f}  p={p:.4f}")
+            elif args.verbose:
+                print(f"           {key:28} {stage:20} x{ratio:5.2f}  p={p:.4f}")
+    for key in sorted(base.keys() - new.keys()):
+        print(f"missing    {key}")
+    print(f"{regressions} significant regression(s)")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="time each pipeline stage on the test inputs"
+    )
+    sub = parser.add_subparsers(required=True)
+
+    p_run = sub.add_parser("run", help="run the benchmarks and save the results")
+    p_run.add_argument("-o", "--output", default="bench-results.json")
+    p_run.add_argument("-n", "--repeat", type=int, default=5)
+    p_run.add_argument("--inputs", default="*.png", help="glob in tests/inputs")
+    p_run.add_argument(
+        "--variants",
+        default="x1,tile2,scale2",
+        help="comma separated: x1, tile<N> (NxN copies), scale<N> (N times larger)",
+    )
+    p_run.add_argument(
+        "--synth",
+        default="",
+        help="comma separated glyph counts of synthetic pages to add, e.g. 500,2000",
+    )
+    p_run.add_argument(
+        "--engine",
+        default="float",
+        help='fitGlyphs engine; "auto" for the tuned one',
+    )
+    p_run.set_defaults(func=cmd_run)
+
+    p_cmp = sub.add_parser("compare", help="flag significant slowdowns")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("results")
+    p_cmp.add_argument("--alpha", type=float, default=0.01)
+    p_cmp.add_argument(
+        "--min-change", type=float, default=0.05, help="ignore smaller slowdowns"
+    )
+    p_cmp.add_argument("-v", "--verbose", action="store_true")
+    p_cmp.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
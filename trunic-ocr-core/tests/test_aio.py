@@ -0,0 +1,67 @@
+import asyncio
+from pathlib import Path
+
+import numpy as np
+import trunic_ocr_core as ocr
+from trunic_ocr_core import aio
+
+test_inputs_dir = Path(__file__).parent.joinpath("inputs")
+
+
+def load(name):
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    return ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+
+
+def test_aio_matches_sync():
+    img = load("13-2.png")
+
+    async def run():
+        stages = aio.findGlyphs(img)
+        progress = [i async for i in stages]
+        strokes_bordered, _prim, geometry, templates, origins = stages.value
+        glyphs = [
+            g
+            async for g in aio.fitGlyphs(strokes_bordered, geometry, templates, origins)
+        ]
+        return progress, glyphs
+
+    progress, glyphs = asyncio.run(run())
+    assert progress == list(range(1, 13))
+    strokes_bordered, _prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img)
+    )
+    assert glyphs == list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins))
+
+
+def test_aio_cancel_closes_generator():
+    img = load("7-4.png")
+
+    async def run():
+        found = await aio.findGlyphs(img).result()
+        fitting = aio.fitGlyphs(found[0], *found[2:])
+        seen = []
+
+        async def consume():
+            async for g in fitting:
+                seen.append(g)
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(consume())
+        while not seen:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        for _ in range(500):
+            if fitting.closed:
+                break
+            await asyncio.sleep(0.01)
+        return fitting, seen, len(found[4])
+
+    fitting, seen, n_glyphs = asyncio.run(run())
+    assert fitting.closed
+    assert fitting.value is None
+    assert 0 < len(seen) < n_glyphs
@@ -0,0 +1,57 @@
+import trunic_ocr_core as ocr
+from trunic_ocr_core import autotune, synth
+
+
+def test_autotune_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRUNIC_OCR_AUTOTUNE", str(tmp_path.joinpath("autotune.json")))
+    ocr.load_fit_tuning.cache_clear()
+    page = synth.random_page(24, seed=0)
+    found = ocr.run_generator(ocr.findGlyphs(page.image))
+    strokes_bordered, _prim, geometry, templates, origins = found
+    assert ocr.tuned_fit_config(geometry.glyph_template_shape) is None
+
+    configs = autotune.candidates(["float", "sparse"], cpus=1)
+    assert configs == [
+        dict(engine="float", workers=None),
+        dict(engine="sparse", workers=None),
+    ]
+    tuned = autotune.autotune([found], configs, repeat=1)
+    bucket = ocr.template_size_bucket(geometry.glyph_template_shape)
+    assert list(tuned) == [bucket]
+    assert tuned[bucket]["glyphs"] == len(origins)
+    autotune.save_fit_tuning(tuned)
+
+    config = ocr.tuned_fit_config(geometry.glyph_template_shape)
+    assert config is not None
+    assert config["engine"] == tuned[bucket]["engine"]
+    # other sizes get the nearest tuned bucket
+    assert ocr.tuned_fit_config((1000, 1000)) == config
+    expected = list(
+        ocr.fitGlyphs(strokes_bordered, geometry, templates, origins, engine="float")
+    )
+    rec = ocr.StageRecorder()
+    glyphs = ocr.fitGlyphs(
+        strokes_bordered, geometry, templates, origins, engine="auto", instrument=rec
+    )
+    assert list(glyphs) == expected
+    assert rec.to_dict()["totals"]["fit_glyph"]["count"] == len(origins)
+
+    # an engine this version doesn't have falls back to "float"
+    tmp_path.joinpath("autotune.json").write_text(
+        '{"%s": {"%d": {"engine": "nonesuch"}}}' % (ocr.fit_tuning_host(), bucket)
+    )
+    ocr.load_fit_tuning.cache_clear()
+    glyphs = ocr.fitGlyphs(
+        strokes_bordered, geometry, templates, origins, engine="auto"
+    )
+    assert list(glyphs) == expected
+    ocr.load_fit_tuning.cache_clear()
+
+    # without "auto", the tuning isn't looked at
+    def no_tuning(_shape):
+        raise AssertionError("tuning consulted")
+
+    monkeypatch.setattr(ocr, "tuned_fit_config", no_tuning)
+    assert list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins)) == (
+        expected
+    )
@@ -0,0 +1,83 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import trunic_ocr_core as ocr
+from trunic_ocr_core.cache import ResultCache
+
+test_inputs_dir = Path(__file__).parent.joinpath("inputs")
+
+
+def load(name):
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    return ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+
+
+def test_cache_hit(tmp_path):
+    img = load("13-2.png")
+    cache = ResultCache(tmp_path)
+    first = cache.recognize(img)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    second = ResultCache(tmp_path).recognize(img.copy())
+    assert second == first
+    strokes_bordered, _prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img)
+    )
+    assert first["glyphs"] == list(
+        ocr.fitGlyphs(strokes_bordered, geometry, templates, origins)
+    )
+
+    # different parameters are different entries
+    cache.recognize(img, slop=1)
+    assert cache.misses == 2
+    assert not list(tmp_path.glob("*/*.tmp"))
+
+
+def test_cache_eviction(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=0)
+    for i in range(3):
+        key = cache.key(np.full((4, 4, 3), i, dtype=np.uint8))
+        cache.put(key, dict(i=i))
+    assert list(tmp_path.glob("*/*.json")) == []
+
+    # room for two entries
+    cache = ResultCache(tmp_path, max_bytes=20)
+    keys = [cache.key(np.full((4, 4, 3), i, dtype=np.uint8)) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, dict(i=i))
+        # distinct recencies, without sleeping
+        os.utime(cache._path(key), (i, i))
+    cache.put(keys[0], dict(i=0))
+    assert cache.get(keys[0]) == dict(i=0)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) == dict(i=2)
+
+
+def test_cache_overwrite_and_stale_tmp(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=20)
+    keys = [cache.key(np.full((4, 4, 3), i, dtype=np.uint8)) for i in range(2)]
+    for key in keys:
+        cache.put(key, dict(i=0))
+    # rewriting an entry doesn't count it twice, so nothing is evicted
+    for _ in range(3):
+        cache.put(keys[0], dict(i=1))
+    assert cache._approx_bytes == 2 * len(b'{"i": 0}')
+    assert cache.get(keys[1]) == dict(i=0)
+
+    stale = cache._path(keys[0]).with_name("dead.tmp")
+    stale.write_bytes(b"{")
+    os.utime(stale, (0, 0))
+    fresh = cache._path(keys[0]).with_name("writing.tmp")
+    fresh.write_bytes(b"{")
+    cache.evict()
+    assert not stale.exists()
+    assert fresh.exists()
+    assert cache.get(keys[0]) == dict(i=1)
+
+
+def test_cache_lax(tmp_path):
+    img = load("7-4.png")
+    result = ResultCache(tmp_path).recognize(img, lax=True)
+    assert result["lax"] is True
+    assert result["glyphs"] == ocr.recognize(img, lax=True)["glyphs"]
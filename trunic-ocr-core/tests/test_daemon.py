@@ -0,0 +1,89 @@
+import base64
+import io
+import json
+from pathlib import Path
+
+import numpy as np
+import trunic_ocr_core as ocr
+from trunic_ocr_core import daemon, server
+
+test_inputs_dir = Path(__file__).parent.joinpath("inputs")
+
+
+def test_daemon_json_lines(tmp_path):
+    img_path = test_inputs_dir.joinpath("13-2.png")
+    img_data = img_path.read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    strokes_bordered, _prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img)
+    )
+    expected = [
+        dict(origin=list(g["origin"]), strokes=list(g["strokes"]))
+        for g in ocr.fitGlyphs(strokes_bordered, geometry, templates, origins)
+    ]
+
+    service = server.OcrService(batch_window=0)
+    worker = daemon.OcrDaemon(service, workers=2)
+    try:
+        worker.warm_up([geometry])
+        assert len(service.templates) == 1
+        requests = [
+            dict(id=1, op="recognize", path=str(img_path)),
+            dict(id=2, op="recognize", data=base64.b64encode(img_data).decode()),
+            dict(id=3, op="recognize", data="not an image"),
+            dict(id=4, op="frobnicate"),
+            dict(id=6, op="recognize", data=""),
+            dict(id=7, op="recognize", path=str(tmp_path.joinpath("missing.png"))),
+        ]
+        rfile = io.BytesIO(
+            b"".join(json.dumps(r).encode() + b"\n" for r in requests) + b"{\n"
+        )
+        wfile = io.BytesIO()
+        worker.serve_lines(rfile, wfile)
+        responses = [json.loads(line) for line in wfile.getvalue().splitlines()]
+        by_id = {r.get("id"): r for r in responses}
+        stats = worker.handle(dict(id=5, op="stats"))["result"]
+        health = worker.handle(dict(op="health"))["result"]
+    finally:
+        worker.close()
+        service.close()
+
+    assert len(responses) == 7
+    for i in (1, 2):
+        assert by_id[i]["result"]["glyphs"] == expected
+        assert by_id[i]["result"]["lax"] is False
+    for i in (3, 6, 7):
+        assert by_id[i]["error"] == "could not decode image"
+    assert "error" in by_id[4]
+    assert by_id[None]["error"] == "invalid JSON"
+
+    # both requests were served from the prewarmed templates
+    assert stats["template_cache"]["misses"] == 1
+    assert stats["template_cache"]["hits"] == 2
+    assert stats["daemon"] == dict(requests=7, ok=2, errors=5)
+    assert health["ok"] and health["in_flight"] == 0
+
+    warm_file = tmp_path.joinpath("warm.json")
+    daemon.save_warm_file(warm_file, service.templates.geometries())
+    assert [g.to_pod() for g in daemon.load_warm_file(warm_file)] == [geometry.to_pod()]
+    assert daemon.load_warm_file(tmp_path.joinpath("missing.json")) == []
+
+
+def test_daemon_echoes_id_on_unexpected_errors():
+    class Failing(daemon.OcrDaemon):
+        def handle(self, request):
+            raise RuntimeError
+
+    service = server.OcrService()
+    worker = Failing(service, workers=1)
+    try:
+        wfile = io.BytesIO()
+        worker.serve_lines(io.BytesIO(b'{"id": 1, "op": "health"}\n[2]\n'), wfile)
+    finally:
+        worker.close()
+        service.close()
+    responses = [json.loads(line) for line in wfile.getvalue().splitlines()]
+    assert sorted(responses, key=lambda r: r["id"] or 0) == [
+        dict(id=None, error="RuntimeError"),
+        dict(id=1, error="RuntimeError"),
+    ]
@@ -0,0 +1,364 @@
+import functools
+import json
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+import trunic_ocr_core as ocr
+
+test_inputs_dir = Path(__file__).parent.joinpath("inputs")
+
+test_input_names = ["7-4.png", "13-2.png", "vowel-table.png"]
+
+
+@functools.cache
+def detect(name):
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    return ocr.run_generator(ocr.findGlyphs(img))
+
+
+@functools.cache
+def reference_glyphs(name):
+    strokes_bordered, _prim, geometry, templates, origins = detect(name)
+    return list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins))
+
+
+@pytest.mark.parametrize("name", test_input_names)
+def test_fit_glyph_at_parity(name):
+    strokes_bordered, _prim, geometry, templates, origins = detect(name)
+    score_maps = ocr.prepareScoreMaps(strokes_bordered, geometry, templates)
+    glyphs = [ocr.fitGlyphAt(score_maps, o) for o in origins]
+    assert glyphs == reference_glyphs(name)
+
+    # a second pass, as when dragging a glyph back and forth, is all lookups
+    misses = score_maps.misses
+    assert [ocr.fitGlyphAt(score_maps, o) for o in origins] == glyphs
+    assert score_maps.misses == misses
+
+    small = ocr.prepareScoreMaps(
+        strokes_bordered, geometry, templates, tile_size=16, max_tiles=2
+    )
+    assert [ocr.fitGlyphAt(small, o) for o in origins[:10]] == glyphs[:10]
+    assert len(small) <= 2
+
+
+def test_find_glyphs_progressive():
+    name = test_input_names[0]
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    gen = ocr.findGlyphs(img, progressive=True)
+    events = []
+    while True:
+        try:
+            events.append(next(gen))
+        except StopIteration as e:
+            ret = e.value
+            break
+
+    assert events[:12] == list(range(1, 13))
+    assert events[12]["geometry"] == ret[2].to_pod()
+    lines = events[13:]
+    assert [line["line"] for line in lines] == list(range(len(lines)))
+    assert [g for line in lines for g in line["glyphs"]] == reference_glyphs(name)
+
+
+def test_find_glyphs_preview():
+    name = test_input_names[0]
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    gen = ocr.findGlyphs(img, preview=True)
+    preview = next(gen)
+    assert preview["geometry_prim"]["upscale"] == 2
+    assert len(preview["glyphs"]) == len(reference_glyphs(name))
+    assert [next(gen) for _ in range(12)] == list(range(1, 13))
+    strokes_bordered, _prim, geometry, templates, origins = ocr.run_generator(gen)
+
+    assert np.array_equal(origins, detect(name)[4])
+    glyphs = ocr.fitGlyphs(strokes_bordered, geometry, templates, origins)
+    assert list(glyphs) == reference_glyphs(name)
+
+
+def test_recognize_past_deadline():
+    name = test_input_names[0]
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    result = ocr.recognize(img, deadline=1e-9)
+    assert result["glyphs"] == []
+    assert result["degradations"] == [
+        "sampled_glyph_height",
+        "sampled_spacing_fit",
+        "partial_glyphs",
+    ]
+
+    # too far past the deadline to retry in lax mode after the strict pass fails
+    with pytest.raises(Exception) as excinfo:
+        ocr.recognize(np.zeros((200, 200), dtype=np.uint8), deadline=1e-9)
+    assert excinfo.value.degradations[-1] == "no_lax_retry"
+
+
+def test_find_glyphs_instrumented():
+    name = test_input_names[0]
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    rec = ocr.StageRecorder()
+    strokes_bordered, _prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img, instrument=rec)
+    )
+    list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins, instrument=rec))
+
+    totals = rec.to_dict()["totals"]
+    assert len(totals) == 14
+    assert totals["fit_glyph"]["count"] == len(origins)
+    assert rec.stages[12]["name"] == "templates"
+    assert rec.stages[12]["sizes"]["glyphs"] == len(origins)
+    trace = json.loads(json.dumps(rec.to_chrome_trace()))
+    assert len(trace["traceEvents"]) == len(rec.stages)
+    by_name = {st["name"]: st for st in rec.stages}
+    assert by_name["clean_strokes"]["sizes"]["n_comp"] > 0
+    baselines = by_name["find_baselines"]["sizes"]
+    assert baselines["n_comp"] >= baselines["baselines"] > 0
+
+
+def test_stage_recorder_trace_memory():
+    assert not tracemalloc.is_tracing()
+    a = ocr.StageRecorder(trace_memory=True)
+    b = ocr.StageRecorder(trace_memory=True)
+    a.begin("alone")
+    buf = bytearray(1 << 20)
+    a.end()
+    assert not tracemalloc.is_tracing()
+
+    # tracemalloc's peak is process-wide, so overlapping stages don't get one
+    a.begin("first")
+    b.begin("second")
+    b.end()
+    a.end()
+    assert not tracemalloc.is_tracing()
+    assert a.stages[0]["peak_alloc"] >= len(buf)
+    assert a.stages[1]["peak_alloc"] is None
+    assert b.stages[0]["peak_alloc"] is None
+
+    # tracing someone else started is left alone
+    tracemalloc.start()
+    try:
+        a.begin("traced")
+        a.end()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    assert a.stages[2]["peak_alloc"] is not None
+
+
+@pytest.mark.parametrize("name", test_input_names[:1])
+def test_fit_glyphs_diagnostics(name):
+    strokes_bordered, _prim, geometry, templates, origins = detect(name)
+    glyphs = list(
+        ocr.fitGlyphs(strokes_bordered, geometry, templates, origins, diagnostics=True)
+    )
+    assert [
+        {k: v for k, v in g.items() if k != "diag"} for g in glyphs
+    ] == reference_glyphs(name)
+    assert all(g["diag"]["margin"] >= 0 for g in glyphs)
+
+    summary = ocr.summarize_fit_diagnostics(glyphs)
+    assert summary["glyphs"] == len(glyphs)
+    assert sum(summary["offset_radius_counts"]) == len(glyphs)
+
+
+def test_fit_glyphs_workers():
+    strokes_bordered, _prim, geometry, templates, origins = detect("7-4.png")
+    rec = ocr.StageRecorder()
+    threaded = list(
+        ocr.fitGlyphs(
+            strokes_bordered, geometry, templates, origins, workers=3, instrument=rec
+        )
+    )
+    assert threaded == list(
+        ocr.fitGlyphs(strokes_bordered, geometry, templates, origins)
+    )
+    assert rec.to_dict()["totals"]["fit_glyph"]["count"] == len(origins)
+
+    deadline = ocr.Deadline(1e-9)
+    assert (
+        list(
+            ocr.fitGlyphs(
+                strokes_bordered,
+                geometry,
+                templates,
+                origins,
+                workers=3,
+                deadline=deadline,
+            )
+        )
+        == []
+    )
+    assert deadline.degradations == ["partial_glyphs"]
+
+
+def test_fit_glyphs_array():
+    strokes_bordered, _prim, geometry, templates, origins = detect("13-2.png")
+    glyphs = list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins))
+    arr = ocr.fitGlyphsArray(strokes_bordered, geometry, templates, origins)
+    assert arr.dtype == ocr.GLYPHS_DTYPE
+    assert ocr.array_to_glyphs(arr) == glyphs
+    assert memoryview(arr).nbytes == len(glyphs) * 10
+
+    scored = ocr.fitGlyphsArray(
+        strokes_bordered, geometry, templates, origins, score=True
+    )
+    np.testing.assert_array_equal(scored["strokes"], arr["strokes"])
+    assert np.all((scored["score"] > 0) & (scored["score"] <= 1))
+
+
+def test_decode_image_gray(tmp_path):
+    path = test_inputs_dir.joinpath("13-2.png")
+    img_data = path.read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    gray, reduction = ocr.decodeImageGray(img_data)
+    assert reduction == 1
+    assert np.array_equal(ocr.preprocess(gray)[0], ocr.preprocess(img)[0])
+    from_path, _ = ocr.decodeImageGray(path)
+    assert np.array_equal(from_path, gray)
+
+    h, w = gray.shape
+    assert ocr.probe_image_size(np.frombuffer(img_data, dtype=np.uint8)) == (w, h)
+    reduced, reduction = ocr.decodeImageGray(img_data, max_pixels=(w * h + 3) // 4)
+    assert reduction == 2
+    assert reduced.shape == (h // 2, w // 2)
+    approx, _ = ocr.decodeImageGray(img_data, exact=False)
+    assert approx.shape == gray.shape
+
+    empty = tmp_path.joinpath("empty.png")
+    empty.write_bytes(b"")
+    for data in (b"not an image", b"", img_data[:100], empty):
+        with pytest.raises(ValueError):
+            ocr.decodeImageGray(data)
+
+
+def test_decode_image_gray_memory():
+    img_data = test_inputs_dir.joinpath("3-1.png").read_bytes()
+
+    def peak(f):
+        tracemalloc.start()
+        try:
+            out = f()
+            return out, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    img, color_peak = peak(
+        lambda: ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    )
+    (gray, _), gray_peak = peak(lambda: ocr.decodeImageGray(img_data))
+    assert np.array_equal(gray, cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    # no more than the colour image, and that isn't kept
+    assert gray_peak < color_peak * 1.05
+    assert gray.base is None or gray.base.nbytes == gray.nbytes
+
+    rng = np.random.default_rng(0)
+    for h in (1, 5, 16, 17, 49, 700):
+        bgr = rng.integers(0, 256, (h, 7, 3), dtype=np.uint8)
+        expected = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        assert np.array_equal(ocr.bgr_to_gray_inplace(bgr), expected)
+
+
+@pytest.mark.parametrize("name", test_input_names)
+def test_jit_kernels_parity(name, monkeypatch):
+    pytest.importorskip("numba")
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+
+    def run(jit):
+        monkeypatch.setenv("TRUNIC_OCR_JIT", jit)
+        ocr.jit_kernels.cache_clear()
+        try:
+            strokes_bordered, prim, geometry, templates, origins = ocr.run_generator(
+                ocr.findGlyphs(img)
+            )
+            glyphs = list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins))
+        finally:
+            ocr.jit_kernels.cache_clear()
+        return strokes_bordered, prim, origins, glyphs
+
+    compiled = run("1")
+    reference = run("0")
+    assert np.array_equal(compiled[0], reference[0])
+    assert compiled[1] == reference[1]
+    assert np.array_equal(compiled[2], reference[2])
+    assert compiled[3] == reference[3]
+
+
+# 7-1 is only recognized in lax mode
+@pytest.mark.parametrize("name", ["7-4.png", "7-1.png"])
+def test_recognize_speculative(name):
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    assert ocr.recognize(img, speculative=True) == ocr.recognize(img)
+
+
+@pytest.mark.parametrize("name", test_input_names)
+def test_fit_glyphs_int_engine(name):
+    strokes_bordered, _prim, geometry, templates, origins = detect(name)
+    quantized = ocr.quantize_templates(templates)
+    assert np.allclose(
+        quantized.glyphs / ocr.TEMPLATE_QUANTUM, templates.glyphs, rtol=0, atol=1e-6
+    )
+    assert np.allclose(
+        quantized.base / ocr.TEMPLATE_QUANTUM, templates.base, rtol=0, atol=1e-6
+    )
+    glyphs = list(
+        ocr.fitGlyphs(strokes_bordered, geometry, templates, origins, engine="int")
+    )
+    assert glyphs == reference_glyphs(name)
+
+
+@pytest.mark.parametrize("engine", ["sparse", "sparse_int"])
+@pytest.mark.parametrize("name", test_input_names)
+def test_fit_glyphs_sparse_engine(name, engine):
+    strokes_bordered, _prim, geometry, templates, origins = detect(name)
+    support = ocr.template_support(
+        templates, geometry.glyph_template_shape, strokes_bordered.shape[1]
+    )
+    # nothing outside the support
+    outside = np.ones(templates.base.size, dtype=np.bool_)
+    outside[support.window] = False
+    assert not np.any(templates.glyphs.reshape(len(templates.glyphs), -1)[:, outside])
+    assert not np.any(templates.base.reshape(-1)[outside])
+    glyphs = list(
+        ocr.fitGlyphs(strokes_bordered, geometry, templates, origins, engine=engine)
+    )
+    assert glyphs == reference_glyphs(name)
+
+
+@pytest.mark.parametrize("engine", ["float", "sparse"])
+def test_fit_glyphs_memo(engine):
+    strokes_bordered, _prim, geometry, templates, origins = detect("7-4.png")
+    memo = ocr.FitMemo()
+    glyphs = list(
+        ocr.fitGlyphs(
+            strokes_bordered, geometry, templates, origins, engine=engine, memo=memo
+        )
+    )
+    assert glyphs == reference_glyphs("7-4.png")
+    # repeated glyphs within a page don't match exactly
+    assert (memo.hits, memo.misses) == (0, len(origins))
+    assert len(memo) == len(origins)
+    # the same page submitted again comes entirely from the memo
+    strokes_bordered, _prim, geometry, templates, origins = detect.__wrapped__(
+        "7-4.png"
+    )
+    again = list(
+        ocr.fitGlyphs(
+            strokes_bordered, geometry, templates, origins, engine=engine, memo=memo
+        )
+    )
+    assert again == glyphs
+    assert (memo.hits, memo.misses) == (len(origins), len(origins))
+    assert memo.hit_rate == 0.5
+
+    small = ocr.FitMemo(max_size=4)
+    list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins, memo=small))
+    assert len(small) == 4
@@ -0,0 +1,57 @@
+import functools
+from pathlib import Path
+
+import numpy as np
+import pytest
+import trunic_ocr_core as ocr
+from trunic_ocr_core import serialize
+
+test_inputs_dir = Path(__file__).parent.joinpath("inputs")
+
+
+@functools.cache
+def detect(name):
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    return ocr.run_generator(ocr.findGlyphs(img))
+
+
+@pytest.mark.parametrize("strokes", ["bits", "uint8", "float32"])
+def test_detection_roundtrip(strokes, tmp_path):
+    found = detect("13-2.png")
+    path = tmp_path.joinpath("13-2.det")
+    serialize.save_detection(path, found, strokes=strokes)
+    assert path.stat().st_size == serialize.detection_nbytes(found, strokes=strokes)
+    loaded = serialize.load_detection(path)
+
+    np.testing.assert_array_equal(loaded[0], found[0])
+    assert loaded[1] == found[1]
+    assert loaded[2].to_pod() == found[2].to_pod()
+    np.testing.assert_array_equal(loaded[3].glyphs, found[3].glyphs)
+    np.testing.assert_array_equal(loaded[3].mask, found[3].mask)
+    np.testing.assert_array_equal(loaded[3].base, found[3].base)
+    np.testing.assert_array_equal(loaded[4], found[4])
+    assert list(ocr.fitGlyphs(*loaded[:1], *loaded[2:])) == list(
+        ocr.fitGlyphs(*found[:1], *found[2:])
+    )
+
+
+def test_detection_shared_memory():
+    found = detect("7-4.png")
+    shm = serialize.detection_to_shared_memory(found)
+    try:
+        loaded, shm2 = serialize.detection_from_shared_memory(shm.name)
+        assert np.shares_memory(loaded[4], np.frombuffer(shm2.buf, dtype=np.uint8))
+        np.testing.assert_array_equal(loaded[4], found[4])
+        del loaded
+        shm2.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_detection_bad_header():
+    buf = serialize.pack_detection(detect("7-4.png"))
+    buf[:8] = b"NOTADET!"
+    with pytest.raises(serialize.DetectionFormatError):
+        serialize.unpack_detection(buf)
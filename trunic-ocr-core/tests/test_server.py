@@ -0,0 +1,127 @@
+import concurrent.futures
+import contextlib
+import http.client
+import json
+import threading
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+import trunic_ocr_core as ocr
+from trunic_ocr_core import server
+
+test_inputs_dir = Path(__file__).parent.joinpath("inputs")
+
+
+# posts each of `names` concurrently; returns the results and the metrics after
+def post_all(service: server.OcrService, names: list[str]):
+    httpd = server.make_server(service)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    def post(name):
+        img_data = test_inputs_dir.joinpath(name).read_bytes()
+        req = urllib.request.Request(f"{url}/recognize", data=img_data)
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            return json.load(resp)
+
+    with contextlib.ExitStack() as stack:
+        stack.callback(service.close)
+        stack.callback(httpd.server_close)
+        stack.callback(httpd.shutdown)
+        with concurrent.futures.ThreadPoolExecutor(len(names)) as executor:
+            results = list(executor.map(post, names))
+        with urllib.request.urlopen(f"{url}/metrics") as resp:
+            metrics = json.load(resp)
+    return results, metrics
+
+
+def expected_glyphs(name, geometry_quantum=0.0):
+    img_data = test_inputs_dir.joinpath(name).read_bytes()
+    img = ocr.decodeImage(np.frombuffer(img_data, dtype=np.uint8))
+    strokes_bordered, prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(img)
+    )
+    if geometry_quantum > 0:
+        key = server.geometry_cache_key(prim, geometry_quantum)
+        geometry = ocr.make_glyph_geometry_from_prim(
+            dict(prim, **dict(zip(("size", "upper", "lower", "h_nudge"), key[3:])))
+        )
+        templates = ocr.make_templates(geometry)
+    return [
+        dict(origin=list(g["origin"]), strokes=list(g["strokes"]))
+        for g in ocr.fitGlyphs(strokes_bordered, geometry, templates, origins)
+    ]
+
+
+def test_server_fits_requests_separately():
+    names = ["13-2.png", "7-4.png"]
+    results, metrics = post_all(server.OcrService(fit_workers=2), names)
+    for name, result in zip(names, results):
+        assert result["glyphs"] == expected_glyphs(name)
+        assert result["lax"] is False
+    assert metrics["counters"]["requests"] == 2
+    assert metrics["counters"]["batches"] == 2
+    assert metrics["batch_requests"]["max"] == 1
+    assert metrics["latency"]["total"]["count"] == 2
+
+
+def test_server_coalesces_requests():
+    # a long window, so the batch is only flushed once both requests are in
+    service = server.OcrService(batch_fit=True, batch_window=60, max_batch_requests=2)
+    results, metrics = post_all(service, ["13-2.png", "13-2.png"])
+    expected = expected_glyphs("13-2.png")
+    for result in results:
+        assert result["glyphs"] == expected
+        assert result["lax"] is False
+
+    assert metrics["counters"]["requests"] == 2
+    assert metrics["counters"]["batches"] == 1
+    assert metrics["batch_requests"]["max"] == 2
+    assert metrics["batch_glyphs"]["max"] == 2 * len(expected)
+    assert metrics["latency"]["total"]["count"] == 2
+
+
+def test_server_coalesces_similar_pages():
+    # different pages whose geometries round to the same key
+    names = ["13-2.png", "13-3.png"]
+    service = server.OcrService(
+        batch_fit=True, batch_window=60, max_batch_requests=2, geometry_quantum=2.0
+    )
+    results, metrics = post_all(service, names)
+    for name, result in zip(names, results):
+        assert result["glyphs"] == expected_glyphs(name, geometry_quantum=2.0)
+    assert metrics["counters"]["batches"] == 1
+    assert metrics["batch_requests"]["max"] == 2
+
+
+def test_server_rejects_bad_requests():
+    service = server.OcrService()
+    httpd = server.make_server(service)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    def post(body, headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", httpd.server_address[1])
+        try:
+            conn.putrequest("POST", "/recognize")
+            if headers is None:
+                headers = {"Content-Length": str(len(body))}
+            for k, v in headers.items():
+                conn.putheader(k, v)
+            conn.endheaders(body)
+            resp = conn.getresponse()
+            return resp.status, json.load(resp)
+        finally:
+            conn.close()
+
+    try:
+        png = test_inputs_dir.joinpath("13-2.png").read_bytes()
+        for body in (b"", b"not an image", png[:100]):
+            assert post(body) == (400, dict(error="could not decode image"))
+        assert post(b"", {})[0] == 411
+        for length in ("ten", "-1"):
+            assert post(b"", {"Content-Length": length})[0] == 400
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        service.close()
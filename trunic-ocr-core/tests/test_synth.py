@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import trunic_ocr_core as ocr
+from trunic_ocr_core import synth
+
+
+def test_geometry_from_prim_roundtrip():
+    page = synth.random_page(60, seed=0)
+    _sb, prim, geometry, _t, _o = ocr.run_generator(ocr.findGlyphs(page.image))
+    rebuilt = ocr.make_glyph_geometry_from_prim(prim)
+    assert rebuilt.glyph_template_shape == geometry.glyph_template_shape
+    np.testing.assert_array_equal(
+        rebuilt.glyph_template_origin, geometry.glyph_template_origin
+    )
+    np.testing.assert_allclose(rebuilt.circle_center, geometry.circle_center)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [dict(), dict(noise=8), dict(contrast=0.3), dict(invert=True)],
+    ids=["clean", "noisy", "faint", "inverted"],
+)
+def test_synth_page_recognized(kwargs):
+    page = synth.random_page(120, seed=1, **kwargs)
+    strokes_bordered, _prim, geometry, templates, origins = ocr.run_generator(
+        ocr.findGlyphs(page.image)
+    )
+    glyphs = list(ocr.fitGlyphs(strokes_bordered, geometry, templates, origins))
+
+    assert len(glyphs) == len(page.glyphs)
+    upscale = page.geometry_prim["upscale"]
+    for found, truth in zip(glyphs, page.glyphs):
+        assert np.all(np.abs(np.subtract(found["origin"], truth["origin"])) <= upscale)
+    matching = sum(
+        tuple(found["strokes"]) == truth["strokes"]
+        for found, truth in zip(glyphs, page.glyphs)
+    )
+    assert matching >= 0.95 * len(glyphs)
+
+
+def test_recognize_blocks_mixed_scales():
+    small = synth.random_page(60, seed=1)
+    large = synth.random_page(
+        40, dict(size=80.0, stroke_width=14), seed=2, line_glyphs=12
+    )
+    h0, w0 = small.image.shape[:2]
+    h1, w1 = large.image.shape[:2]
+    page = np.full((h0 + h1, max(w0, w1), 3), small.image[0, 0], dtype=np.uint8)
+    page[:h0, :w0] = small.image
+    page[h0:, :w1] = large.image
+    upscale = small.geometry_prim["upscale"]
+
+    blocks = ocr.recognize_blocks(page)
+    assert [b["error"] for b in blocks] == [None, None]
+    for block, truth, offset in zip(blocks, (small, large), (0, h0 * upscale)):
+        assert block["geometry_prim"]["size"] == pytest.approx(
+            truth.geometry_prim["size"], rel=0.02
+        )
+        assert len(block["glyphs"]) == len(truth.glyphs)
+        matching = 0
+        for found, expected in zip(block["glyphs"], truth.glyphs):
+            delta = np.subtract(found["origin"], expected["origin"]) - [0, offset]
+            assert np.all(np.abs(delta) <= upscale)
+            matching += tuple(found["strokes"]) == expected["strokes"]
+        assert matching >= 0.95 * len(truth.glyphs)
@@ -1,5 +1,15 @@
+import collections
+import concurrent.futures
+import functools
 import gc
+import hashlib
+import json
 import math
+import os
+import platform
+import threading
+import time
+import tracemalloc
 import typing
 from dataclasses import dataclass
 
@@ -8,6 +18,7 @@ import numpy as np
 import numpy.typing as npt
 
 type NDArray_u8 = npt.NDArray[np.uint8]
+type NDArray_i16 = npt.NDArray[np.int16]
 type NDArray_i32 = npt.NDArray[np.int32]
 type NDArray_f32 = npt.NDArray[np.float32]
 type NDArray_f64 = npt.NDArray[np.float64]
@@ -15,6 +26,18 @@ type SegCoordArrI = npt.NDArray[np.uint32]
 type SegCoordArrF = npt.NDArray[np.float64]
 
 
+# the compiled kernels in `jit`, if Numba is installed and `TRUNIC_OCR_JIT` isn't 0
+@functools.cache
+def jit_kernels():
+    if os.environ.get("TRUNIC_OCR_JIT", "1") == "0":
+        return None
+    try:
+        from . import jit
+    except ImportError:
+        return None
+    return jit
+
+
 def decodeImage(imgData: memoryview) -> NDArray_u8:
     return cv2.imdecode(np.asarray(imgData), cv2.IMREAD_COLOR)
 
@@ -31,35 +54,519 @@ def loadBitmap(bmpData: memoryview, width: int, height: int) -> NDArray_u8:
     return np.asarray(bmpData).reshape(height, width, 4)
 
 
-def findGlyphs(src_raw: NDArray_u8, *, lax=False):
-    src, upscale = preprocess(src_raw)
+# decodes straight to the grayscale image `preprocess` wants, from encoded bytes or a
+# file (memory-mapped, not read into memory). with `max_pixels`, larger images are
+# decoded at 1/2, 1/4 or 1/8 scale, which is also returned; glyph coordinates then
+# have to be scaled back up by it
+#
+# `exact` decodes to colour and converts like `preprocess` does, in place
+# (`bgr_to_gray_inplace`): the peak is the colour image, as for `decodeImage`, and
+# the result is a third of that. otherwise the codec decodes to grayscale itself,
+# which peaks at the grayscale image but weighs channels differently: some glyphs
+# of the test images come out differently
+#
+# anything that can't be decoded raises `ValueError`
+def decodeImageGray(
+    src: bytes | memoryview | np.ndarray | str | os.PathLike,
+    *,
+    max_pixels: int | None = None,
+    exact=True,
+) -> tuple[NDArray_u8, int]:
+    if isinstance(src, (str, os.PathLike)):
+        data = np.memmap(src, dtype=np.uint8, mode="r")
+    else:
+        data = np.frombuffer(src, dtype=np.uint8)
+    # `imdecode` raises `cv2.error` on no data rather than returning None
+    if data.size == 0:
+        raise ValueError("could not decode image")
+
+    reduction = 1
+    if max_pixels is not None and (size := probe_image_size(data)) is not None:
+        while reduction < 8 and size[0] * size[1] > max_pixels * reduction**2:
+            reduction *= 2
+    flags = {
+        (1, True): cv2.IMREAD_COLOR,
+        (2, True): cv2.IMREAD_REDUCED_COLOR_2,
+        (4, True): cv2.IMREAD_REDUCED_COLOR_4,
+        (8, True): cv2.IMREAD_REDUCED_COLOR_8,
+        (1, False): cv2.IMREAD_GRAYSCALE,
+        (2, False): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        (4, False): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        (8, False): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    }
+    try:
+        img = cv2.imdecode(data, flags[reduction, exact])
+    except cv2.error as e:
+        # e.g. some corrupt headers
+        raise ValueError("could not decode image") from e
+    del data
+    if img is None:
+        raise ValueError("could not decode image")
+    if exact:
+        img = bgr_to_gray_inplace(img)
+    return img, reduction
+
+
+# `cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)`, written over the start of `img` a band of
+# rows at a time, then shrunk to fit; so there's never a second full-size buffer.
+# rows `[a, b)` land on bytes `[a * w, b * w)`, clear of the unread colour rows from
+# `3 * a * w` as long as `b <= 3 * a`; the first band goes through a small copy
+def bgr_to_gray_inplace(img: NDArray_u8, band_rows=256) -> NDArray_u8:
+    h, w = img.shape[:2]
+    flat = img.reshape(-1)
+    first_rows = min(h, 16)
+    first = cv2.cvtColor(img[:first_rows], cv2.COLOR_BGR2GRAY)
+    a = first_rows
+    while a < h:
+        b = min(h, 3 * a, a + band_rows)
+        cv2.cvtColor(
+            img[a:b], cv2.COLOR_BGR2GRAY, dst=flat[a * w : b * w].reshape(b - a, w)
+        )
+        a = b
+    flat[: first_rows * w] = first.reshape(-1)
+    del flat, first
+    if not img.flags.owndata:
+        return img.reshape(-1)[: h * w].reshape(h, w).copy()
+    img.resize(h * w, refcheck=False)
+    return img.reshape(h, w)
+
+
+# (width, height) from a PNG or JPEG header, without decoding
+def probe_image_size(data: np.ndarray) -> tuple[int, int] | None:
+    head = bytes(data[:32])
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+        return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+    if head.startswith(b"\xff\xd8"):
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                return None
+            marker = int(data[i + 1])
+            seg_len = int(data[i + 2]) << 8 | int(data[i + 3])
+            # start of frame, except DHT, JPG and DAC
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                h = int(data[i + 5]) << 8 | int(data[i + 6])
+                w = int(data[i + 7]) << 8 | int(data[i + 8])
+                return w, h
+            i += 2 + seg_len
+    return None
+
+
+# fraction of a `Deadline` that detection may use before it starts cutting corners
+DEADLINE_DETECT_SHARE = 0.3
+# past this fraction of a `Deadline`, a failed strict pass is not retried in lax mode
+DEADLINE_LAX_RETRY_SHARE = 0.5
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.start = time.perf_counter()
+        self.degradations: list[str] = []
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def remaining(self) -> float:
+        return self.seconds - self.elapsed()
+
+    def used(self) -> float:
+        return self.elapsed() / self.seconds
+
+    def degrade(self, degradation: str):
+        if degradation not in self.degradations:
+            self.degradations.append(degradation)
+
+
+# stages being traced by any `StageRecorder`, in any thread. tracemalloc's peak is
+# process-wide, so it is only reset when none are open, and the peak of a stage that
+# overlapped another one is `None`: it can't be told apart from the other's. tracing
+# started for these is stopped again once the last of them ends
+_traced_stages_lock = threading.Lock()
+_traced_stages: dict[int, dict[str, typing.Any]] = dict()
+_traced_stages_started_tracing = False
+
+
+# per-stage wall/CPU time, peak traced allocation and sizes, in the order run
+class StageRecorder:
+    def __init__(self, *, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.origin = time.perf_counter()
+        self.stages: list[dict[str, typing.Any]] = []
+        # open stage per thread, so threads can record concurrently
+        self._open: dict[int, dict[str, typing.Any]] = dict()
+
+    def begin(self, name: str):
+        st = dict(
+            name=name,
+            thread=threading.get_ident(),
+            mem_start=0,
+            overlapped=False,
+        )
+        if self.trace_memory:
+            global _traced_stages_started_tracing
+            with _traced_stages_lock:
+                if not _traced_stages:
+                    if not tracemalloc.is_tracing():
+                        tracemalloc.start()
+                        _traced_stages_started_tracing = True
+                    tracemalloc.reset_peak()
+                else:
+                    for other in _traced_stages.values():
+                        other["overlapped"] = True
+                    st["overlapped"] = True
+                _traced_stages[id(st)] = st
+                st["mem_start"] = tracemalloc.get_traced_memory()[0]
+        self._open[threading.get_ident()] = st
+        st["start"] = time.perf_counter()
+        st["cpu_start"] = time.process_time()
+
+    def end(self, **sizes):
+        st = self._open.pop(threading.get_ident())
+        wall = time.perf_counter() - st["start"]
+        cpu = time.process_time() - st["cpu_start"]
+        peak = None
+        if self.trace_memory:
+            global _traced_stages_started_tracing
+            with _traced_stages_lock:
+                if not st["overlapped"]:
+                    peak = tracemalloc.get_traced_memory()[1] - st["mem_start"]
+                del _traced_stages[id(st)]
+                if not _traced_stages and _traced_stages_started_tracing:
+                    tracemalloc.stop()
+                    _traced_stages_started_tracing = False
+        self.stages.append(
+            dict(
+                name=st["name"],
+                thread=st["thread"],
+                start=st["start"] - self.origin,
+                wall=wall,
+                cpu=cpu,
+                peak_alloc=peak,
+                sizes={
+                    k: list(v) if isinstance(v, tuple) else v for k, v in sizes.items()
+                },
+            )
+        )
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        totals: dict[str, dict[str, typing.Any]] = dict()
+        for st in self.stages:
+            t = totals.setdefault(
+                st["name"], dict(count=0, wall=0.0, cpu=0.0, peak_alloc=None)
+            )
+            t["count"] += 1
+            t["wall"] += st["wall"]
+            t["cpu"] += st["cpu"]
+            if st["peak_alloc"] is not None:
+                t["peak_alloc"] = max(t["peak_alloc"] or 0, st["peak_alloc"])
+        return dict(stages=[dict(st) for st in self.stages], totals=totals)
+
+    # Chrome trace-event format, for chrome://tracing or Perfetto
+    def to_chrome_trace(self) -> dict[str, typing.Any]:
+        pid = os.getpid()
+        return dict(
+            traceEvents=[
+                dict(
+                    name=st["name"],
+                    cat="trunic_ocr",
+                    ph="X",
+                    ts=st["start"] * 1e6,
+                    dur=st["wall"] * 1e6,
+                    pid=pid,
+                    tid=st["thread"],
+                    args=dict(
+                        cpu_ms=st["cpu"] * 1e3,
+                        **(
+                            dict(peak_alloc=st["peak_alloc"])
+                            if st["peak_alloc"] is not None
+                            else dict()
+                        ),
+                        **st["sizes"],
+                    ),
+                )
+                for st in self.stages
+            ],
+            displayTimeUnit="ms",
+        )
+
+
+class NullStageRecorder(StageRecorder):
+    def __init__(self):
+        pass
+
+    def begin(self, name: str):
+        pass
+
+    def end(self, **sizes):
+        pass
+
+
+# with `preview`, a quick low-resolution `GlyphPreviewPod` is yielded before stage 1,
+# and the full-resolution pass starts its spacing search from the preview's. the
+# preview's glyph positions aren't reused: they're only accurate to its resolution,
+# and the returned origins, and so `fitGlyphs`, must come out as without `preview`
+#
+# with `progressive`, stage 12 is followed by a `GlyphGeometryFoundPod` and then one
+# `GlyphLinePod` per line of text, in reading order
+def findGlyphs(
+    src_raw: NDArray_u8,
+    *,
+    lax=False,
+    progressive=False,
+    preview=False,
+    preview_upscale=2,
+    deadline: Deadline | None = None,
+    instrument: StageRecorder | None = None,
+):
+    spacing_hint = None
+    if preview:
+        if instrument is not None:
+            instrument.begin("preview")
+        try:
+            (
+                p_strokes_bordered,
+                p_glyph_geometry_prim,
+                p_glyph_geometry,
+                p_glyph_templates,
+                p_glyph_origins_raw,
+                _c,
+            ) = run_generator(find_glyphs_stages(src_raw, preview_upscale, lax=lax))
+            p_glyphs = list(
+                fitGlyphs(
+                    p_strokes_bordered,
+                    p_glyph_geometry,
+                    p_glyph_templates,
+                    p_glyph_origins_raw,
+                )
+            )
+        except Exception:
+            # the preview is best-effort; the full pass will report any real failure
+            if instrument is not None:
+                instrument.end(failed=True)
+        else:
+            if instrument is not None:
+                instrument.end(glyphs=len(p_glyphs))
+            del p_strokes_bordered, p_glyph_templates, p_glyph_origins_raw
+            yield GlyphPreviewPod(
+                geometry_prim=p_glyph_geometry_prim,
+                geometry=p_glyph_geometry.to_pod(),
+                glyphs=p_glyphs,
+            )
+            spacing_hint = p_glyph_geometry_prim["size"]
+
+    upscale = 3
+    (
+        strokes_bordered,
+        glyph_geometry_prim,
+        glyph_geometry,
+        glyph_templates,
+        glyph_origins_raw,
+        line_glyph_counts,
+    ) = yield from find_glyphs_stages(
+        src_raw,
+        upscale,
+        lax=lax,
+        deadline=deadline,
+        instrument=instrument,
+        spacing_hint=(
+            None if spacing_hint is None else spacing_hint * upscale / preview_upscale
+        ),
+    )
+
+    if progressive:
+        yield GlyphGeometryFoundPod(
+            geometry_prim=glyph_geometry_prim, geometry=glyph_geometry.to_pod()
+        )
+        line_origins = np.split(
+            glyph_origins_raw.reshape(-1, 2), np.cumsum(line_glyph_counts)[:-1]
+        )
+        for line_i, origins in enumerate(line_origins):
+            yield GlyphLinePod(
+                line=line_i,
+                glyphs=list(
+                    fitGlyphs(
+                        strokes_bordered,
+                        glyph_geometry,
+                        glyph_templates,
+                        origins,
+                        deadline=deadline,
+                        instrument=instrument,
+                    )
+                ),
+            )
+
+    gc.collect()
+    return (
+        strokes_bordered,
+        glyph_geometry_prim,
+        glyph_geometry,
+        glyph_templates,
+        glyph_origins_raw,
+    )
+
+
+# like `findGlyphs` in strict mode, falling back to lax mode, but both geometry
+# solves run concurrently on one set of stroke stages, so a failed strict solve costs
+# no extra time, given a spare core. yields stages 1 to 12 (6 to 12 of the strict
+# solve), and returns `findGlyphs`'s result and whether it is lax. once strict has
+# succeeded, the lax solve is stopped at its next stage
+def find_glyphs_speculative(
+    src_raw: NDArray_u8,
+    *,
+    upscale=3,
+    deadline: Deadline | None = None,
+    instrument: StageRecorder | None = None,
+    template_cache=None,
+):
+    found = yield from find_strokes_stages(src_raw, upscale, instrument=instrument)
+
+    def geometry_stages(lax):
+        return find_geometry_stages(
+            found,
+            lax=lax,
+            deadline=deadline,
+            instrument=instrument,
+            template_cache=template_cache,
+        )
+
+    stop = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    try:
+        lax_future = executor.submit(run_generator_until, geometry_stages(True), stop)
+        strict = geometry_stages(False)
+        del found
+        try:
+            result = yield from strict
+        except Exception:
+            result = lax_future.result()
+            assert result is not None
+            lax = True
+        else:
+            stop.set()
+            lax = False
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+    gc.collect()
+    return result[:5], lax
+
+
+def find_glyphs_stages(
+    src_raw: NDArray_u8,
+    upscale: int,
+    *,
+    lax=False,
+    deadline: Deadline | None = None,
+    instrument: StageRecorder | None = None,
+    spacing_hint=None,
+    template_cache=None,
+):
+    return (
+        yield from find_geometry_stages(
+            # not bound to a name here, so the arrays can be freed as the later
+            # stages are done with them
+            (yield from find_strokes_stages(src_raw, upscale, instrument=instrument)),
+            lax=lax,
+            deadline=deadline,
+            instrument=instrument,
+            spacing_hint=spacing_hint,
+            template_cache=template_cache,
+        )
+    )
+
+
+# the results of the stages that don't depend on `lax`
+@dataclass
+class FoundStrokes:
+    upscale: int
+    stroke_width: int
+    strokes_raw: NDArray_u8
+    medialAxisMask: NDArray_u8
+    strokes: NDArray_u8
+    strokes_f: NDArray_f32
+
+
+# stages 1 to 5
+def find_strokes_stages(
+    src_raw: NDArray_u8,
+    upscale: int,
+    *,
+    instrument: StageRecorder | None = None,
+) -> typing.Generator[int, typing.Any, FoundStrokes]:
+    rec = instrument if instrument is not None else NullStageRecorder()
+    rec.begin("preprocess")
+    src, upscale = preprocess(src_raw, upscale)
+    rec.end(image=src_raw.shape[:2], upscaled=src.shape[:2])
     yield 1
+    rec.begin("segment_threshold")
     strokes_raw = segmentThreshold(src, upscale)
     del src
+    rec.end(stroke_px=int(np.count_nonzero(strokes_raw)))
     yield 2
+    rec.begin("medial_axis")
     medialAxis, medialAxisMask = mkMedialAxis(strokes_raw)
+    rec.end()
     yield 3
+    rec.begin("stroke_width")
     stroke_width = findStrokeWidth(medialAxis)
+    rec.end(stroke_width=stroke_width)
     yield 4
-    strokes = clean_strokes(strokes_raw, medialAxis, stroke_width)
+    rec.begin("clean_strokes")
+    sizes = dict()
+    strokes = clean_strokes(strokes_raw, medialAxis, stroke_width, sizes=sizes)
     del medialAxis
     strokes_f = np.float32(strokes)
+    rec.end(stroke_px=int(np.count_nonzero(strokes)), **sizes)
     yield 5
+    return FoundStrokes(
+        upscale, stroke_width, strokes_raw, medialAxisMask, strokes, strokes_f
+    )
+
+
+# stages 6 to 12, which only read `found`; with concurrent callers sharing it, its
+# arrays are only freed once they're all done
+def find_geometry_stages(
+    found: FoundStrokes,
+    *,
+    lax=False,
+    deadline: Deadline | None = None,
+    instrument: StageRecorder | None = None,
+    spacing_hint=None,
+    template_cache=None,
+):
+    rec = instrument if instrument is not None else NullStageRecorder()
+    upscale = found.upscale
+    stroke_width = found.stroke_width
+    strokes_raw = found.strokes_raw
+    medialAxisMask = found.medialAxisMask
+    strokes = found.strokes
+    strokes_f = found.strokes_f
+    del found
+    rec.begin("find_baselines")
+    sizes = dict()
     baselines, baselines_spec = find_baselines(
         upscale,
         stroke_width,
         strokes,
         strokes_f,
         **(dict(filter_thresh_pct=80) if lax else dict()),
+        sizes=sizes,
     )
+    rec.end(baselines=len(baselines_spec), **sizes)
     yield 6
+    rec.begin("stroke_angle")
     stroke_angle = find_stroke_angle(medialAxisMask, strokes)
     del medialAxisMask
+    rec.end(stroke_angle=int(stroke_angle))
     yield 7
+    rec.begin("vertical_segments")
     segments_raw_vert, segment_coords_raw_vert = find_vertical_segments(
         upscale, stroke_width, strokes, strokes_f, baselines
     )
+    rec.end(segments=segment_coords_raw_vert.shape[-1])
     yield 8
+    rec.begin("slanted_segments")
     (
         segments_raw_slant_p,
         segment_coords_raw_slant_p,
@@ -67,17 +574,36 @@ def findGlyphs(src_raw: NDArray_u8, *, lax=False):
         segment_coords_raw_slant_n,
     ) = find_slanted_segments(upscale, stroke_width, strokes, strokes_f, stroke_angle)
     del strokes_f
+    rec.end(
+        segments=segment_coords_raw_slant_p.shape[-1]
+        + segment_coords_raw_slant_n.shape[-1]
+    )
     yield 9
+    rec.begin("merge_segments")
     all_segments_raw = segments_raw_vert | segments_raw_slant_p | segments_raw_slant_n
     del segments_raw_vert
     del segments_raw_slant_p
     del segments_raw_slant_n
+    rec.end()
     yield 10
-    approx_glyph_height = find_approx_glyph_height(strokes, baselines, all_segments_raw)
+    rec.begin("approx_glyph_height")
+    # leave the rest of the budget for fitting
+    hurry = deadline is not None and deadline.used() > DEADLINE_DETECT_SHARE
+    if hurry:
+        deadline.degrade("sampled_glyph_height")
+        deadline.degrade("sampled_spacing_fit")
+    approx_glyph_height = find_approx_glyph_height(
+        strokes,
+        baselines,
+        all_segments_raw,
+        **(dict(sample_stride=4) if hurry else dict()),
+    )
     del strokes
     del baselines
     del all_segments_raw
+    rec.end(approx_glyph_height=int(approx_glyph_height))
     yield 11
+    rec.begin("find_geometry")
     all_endpoints = np.concatenate(
         (
             *segment_coords_raw_vert,
@@ -94,13 +620,17 @@ def findGlyphs(src_raw: NDArray_u8, *, lax=False):
         segment_coords_raw_vert,
         approx_glyph_height,
         all_endpoints,
+        spacing_hint=spacing_hint,
         **(dict(spacing_init_bsln_qtl=0.75, spacing_fit_thresh=0.7) if lax else dict()),
+        **(dict(samples_per_check=15) if hurry else dict()),
     )
+    rec.end(endpoints=all_endpoints.shape[1])
     del all_endpoints
     del segment_coords_raw_vert
     del segment_coords_raw_slant_p
     del segment_coords_raw_slant_n
     yield 12
+    rec.begin("templates")
 
     glyph_geometry_prim = dict(
         upscale=upscale,
@@ -128,9 +658,14 @@ def findGlyphs(src_raw: NDArray_u8, *, lax=False):
         offset_l,
     )
 
-    glyph_templates = make_templates(glyph_geometry)
+    glyph_templates = (
+        template_cache.get(glyph_geometry)
+        if template_cache is not None
+        else make_templates(glyph_geometry)
+    )
 
-    baselines_spec = sort_baselines(stroke_width, baselines_spec)
+    baselines_lines = group_baselines(stroke_width, baselines_spec)
+    baselines_spec = [bsln_spec for line in baselines_lines for bsln_spec in line]
 
     glyph_width = glyph_geometry.glyph_width
     glyph_origins_raw = np.array(
@@ -141,7 +676,12 @@ def findGlyphs(src_raw: NDArray_u8, *, lax=False):
         ],
         dtype=np.int32,
     )
+    line_glyph_counts = [
+        sum(round(bsln_spec.length / glyph_width) for bsln_spec in line)
+        for line in baselines_lines
+    ]
     del baselines_spec
+    del baselines_lines
 
     strokes_bordered = cv2.copyMakeBorder(
         np.float32(strokes_raw),
@@ -153,20 +693,29 @@ def findGlyphs(src_raw: NDArray_u8, *, lax=False):
         value=0,
     )
     del strokes_raw
+    rec.end(
+        glyphs=len(glyph_origins_raw),
+        lines=len(line_glyph_counts),
+        template_shape=glyph_geometry.glyph_template_shape,
+    )
 
-    gc.collect()
     return (
         strokes_bordered,
         glyph_geometry_prim,
         glyph_geometry,
         glyph_templates,
         glyph_origins_raw,
+        line_glyph_counts,
     )
 
 
 def preprocess(img: NDArray_u8, upscale=3) -> tuple[NDArray_u8, int]:
-    isBgr = img.shape[2] == 3
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY if isBgr else cv2.COLOR_RGBA2GRAY)
+    if img.ndim == 2:
+        # already grayscale, from `decodeImageGray`
+        gray = img
+    else:
+        isBgr = img.shape[2] == 3
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY if isBgr else cv2.COLOR_RGBA2GRAY)
     ret = cv2.resize(gray, None, None, upscale, upscale, cv2.INTER_CUBIC)
     return (ret, upscale)
 
@@ -231,12 +780,28 @@ def clean_strokes(
     area_ratio_min=2.0,
     stroke_filt_tol=4.0,
     stroke_filt_thresh_pct=65,
+    *,
+    sizes: dict[str, typing.Any] | None = None,
 ) -> NDArray_u8:
     n_comp, cc_labels, cc_stats, _c = cv2.connectedComponentsWithStats(
         strokes_raw, connectivity=4, ltype=cv2.CV_16U
     )
+    if sizes is not None:
+        sizes["n_comp"] = n_comp - 1
 
     strokes_clean = strokes_raw.copy()
+    if (jit := jit_kernels()) is not None:
+        removed = jit.clean_strokes_removed(
+            cc_labels,
+            cc_stats,
+            medialAxis,
+            stroke_width,
+            area_ratio_min,
+            stroke_filt_tol,
+            stroke_filt_thresh_pct,
+        )
+        jit.zero_labels(strokes_clean, cc_labels, removed)
+        return strokes_clean
     for i in range(1, n_comp):
         roi = cv2_cc_get_roi(cc_stats, i)
         if cc_stats[i, cv2.CC_STAT_AREA] < stroke_width * stroke_width * area_ratio_min:
@@ -272,6 +837,8 @@ def find_baselines(
     strokes_f: NDArray_f32,
     min_aspect_ratio=3.5,
     filter_thresh_pct=85,
+    *,
+    sizes: dict[str, typing.Any] | None = None,
 ) -> tuple[NDArray_u8, list[BaselineSpec]]:
     line_min_len = round(stroke_width * min_aspect_ratio)
     kernel_x = np.ones(line_min_len, dtype=np.float32)
@@ -332,13 +899,22 @@ def find_baselines(
     n_cc, cc_labels, cc_stats, _c = cv2.connectedComponentsWithStats(
         bslns_lower_edge_dil
     )
+    if sizes is not None:
+        sizes["n_comp"] = n_cc - 1
     baselines_spec = []
+    if (jit := jit_kernels()) is not None:
+        line_ys = jit.baseline_rows(
+            cc_labels, cc_stats, bslns_lower_edge, bslns_both_edge
+        )
     for i in range(1, n_cc):
         roi = cv2_cc_get_roi(cc_stats, i)
-        cc_mask = cc_labels[roi] == i
-        summed_l = np.sum(bslns_lower_edge[roi] & cc_mask, axis=1, dtype=np.uint32)
-        summed_u = np.sum(bslns_both_edge[roi] & cc_mask, axis=1, dtype=np.uint32)
-        line_y = np.argmax(summed_l + 3 * summed_u)
+        if jit is not None:
+            line_y = line_ys[i]
+        else:
+            cc_mask = cc_labels[roi] == i
+            summed_l = np.sum(bslns_lower_edge[roi] & cc_mask, axis=1, dtype=np.uint32)
+            summed_u = np.sum(bslns_both_edge[roi] & cc_mask, axis=1, dtype=np.uint32)
+            line_y = np.argmax(summed_l + 3 * summed_u)
 
         spec = BaselineSpec(
             roi[1].start + 1 + math.floor((stroke_width - 1) / 2),
@@ -440,12 +1016,23 @@ def find_vertical_segments_gen(
         cv2.dilate(seeds, mk_rect(3, 3))
     )
     coords = np.zeros((2, 2, n_cc - 1), dtype=np.uint32)
+    if (jit := jit_kernels()) is not None:
+        line_xs = jit.segment_columns(
+            cc_labels,
+            cc_stats,
+            img_fill_filt,
+            img_edge_filt,
+            3 * (segment_min_len / upscale),
+        )
     for i in range(1, n_cc):
         roi = cv2_cc_get_roi(cc_stats, i)
-        cc_mask = cc_labels[roi] == i
-        summed_f = np.sum(img_fill_filt[roi] * cc_mask, axis=0)
-        summed_e = np.sum(img_edge_filt[roi] * cc_mask, axis=0)
-        line_x = np.argmax(summed_f + 3 * (segment_min_len / upscale) * summed_e)
+        if jit is not None:
+            line_x = line_xs[i]
+        else:
+            cc_mask = cc_labels[roi] == i
+            summed_f = np.sum(img_fill_filt[roi] * cc_mask, axis=0)
+            summed_e = np.sum(img_edge_filt[roi] * cc_mask, axis=0)
+            line_x = np.argmax(summed_f + 3 * (segment_min_len / upscale) * summed_e)
 
         x = roi[1].start + line_x
         y = roi[0].start + 1 + math.floor((stroke_width - 1) / 2)
@@ -547,6 +1134,7 @@ def find_approx_glyph_height(
     baselines: NDArray_u8,
     all_segments_raw: NDArray_u8,
     percentile=95,
+    sample_stride=1,
 ) -> int:
     dist_baseline = np.uint32(cv2.distanceTransform(1 - baselines, cv2.DIST_C, 3))
 
@@ -556,15 +1144,32 @@ def find_approx_glyph_height(
         1 - strokes_notbl, cv2.DIST_C, 3
     )
 
+    if (jit := jit_kernels()) is not None:
+        dist_bline_ccmax, sampled = jit.voronoi_max(
+            nbs_vrnoi, dist_baseline, strokes_notbl, sample_stride
+        )
+        if sample_stride == 1:
+            sampled = None
+        dists = dist_bline_ccmax[
+            (baselines != 0) if sampled is None else ((baselines != 0) & sampled)
+        ]
+        dists_min, ret, dists_max = np.int32(np.percentile(dists, [0, percentile, 100]))
+        return ret
+
     dist_bline_ccmax = np.zeros(strokes.shape)
-    for i in range(np.min(nbs_vrnoi), np.max(nbs_vrnoi) + 1):
+    sampled = np.zeros(strokes.shape, dtype=np.bool_) if sample_stride > 1 else None
+    for i in range(np.min(nbs_vrnoi), np.max(nbs_vrnoi) + 1, sample_stride):
         vrnoi_mask_raw = nbs_vrnoi == i
         roi = cv_rect_to_roi(cv2.boundingRect(np.uint8(vrnoi_mask_raw)))
         vrnoi_mask = vrnoi_mask_raw[roi]
         dist_bline_ccmax[roi][vrnoi_mask] = np.max(
             dist_baseline[roi][vrnoi_mask & (strokes_notbl[roi] != 0)]
         )
-    dists = dist_bline_ccmax[baselines != 0]
+        if sampled is not None:
+            sampled[roi] |= vrnoi_mask
+    dists = dist_bline_ccmax[
+        (baselines != 0) if sampled is None else ((baselines != 0) & sampled)
+    ]
 
     dists_min, ret, dists_max = np.int32(np.percentile(dists, [0, percentile, 100]))
 
@@ -586,6 +1191,7 @@ def find_geometry(
     samples_per_check=50,
     spacing_init_bsln_qtl=0.25,
     spacing_fit_thresh=0.8,
+    spacing_hint: float | None = None,
 ) -> tuple[NDArray_f32, NDArray_f32, NDArray_f32, NDArray_f32]:
     def filter_in_baseline(
         all_endpoints: npt.NDArray[np.uint32], bsln_spec: BaselineSpec
@@ -626,6 +1232,24 @@ def find_geometry(
     all_endpoints_o_u = np.matmul(xform_inv, np.hstack(all_endpoints_u))
     all_endpoints_o_l = np.matmul(xform_inv, np.hstack(all_endpoints_l))
 
+    def check_spacing(spacing):
+        spacings = np.linspace(
+            spacing - upscale, spacing + upscale, num=samples_per_check
+        )
+        fits_u_x, offsets_u_x = check_grid_fit(all_endpoints_o_u[0], spacings)
+        fits_l_x, offsets_l_x = check_grid_fit(all_endpoints_o_l[0], spacings)
+        fits_u_y, offsets_u_y = check_grid_fit(all_endpoints_o_u[1], spacings)
+        fits_l_y, offsets_l_y = check_grid_fit(all_endpoints_o_l[1], spacings)
+        fits_all = (fits_u_x + fits_l_x + fits_u_y + fits_l_y) / 4
+        m = np.argmax(fits_all)
+        if fits_all[m] > spacing_fit_thresh:
+            return (
+                spacings[m],
+                np.array([offsets_u_x[m], offsets_u_y[m]]),
+                np.array([offsets_l_x[m], offsets_l_y[m]]),
+            )
+        return None
+
     def find_spacing():
         # upper limit for grid spacing; each word must contain at least one grid square
         bsln_min_length = np.quantile(
@@ -634,25 +1258,24 @@ def find_geometry(
             method="closest_observation",
         )
         spacing0 = xform_inv[0, 0] * bsln_min_length
-
         # assume spacing is at least `stroke_width`
-        for spacing_div in range(1, math.ceil(spacing0 / stroke_width) + 1):
-            spacing = spacing0 / spacing_div
-            spacings = np.linspace(
-                spacing - upscale, spacing + upscale, num=samples_per_check
-            )
-            fits_u_x, offsets_u_x = check_grid_fit(all_endpoints_o_u[0], spacings)
-            fits_l_x, offsets_l_x = check_grid_fit(all_endpoints_o_l[0], spacings)
-            fits_u_y, offsets_u_y = check_grid_fit(all_endpoints_o_u[1], spacings)
-            fits_l_y, offsets_l_y = check_grid_fit(all_endpoints_o_l[1], spacings)
-            fits_all = (fits_u_x + fits_l_x + fits_u_y + fits_l_y) / 4
-            m = np.argmax(fits_all)
-            if fits_all[m] > spacing_fit_thresh:
-                return (
-                    spacings[m],
-                    np.array([offsets_u_x[m], offsets_u_y[m]]),
-                    np.array([offsets_l_x[m], offsets_l_y[m]]),
-                )
+        spacing_divs = range(1, math.ceil(spacing0 / stroke_width) + 1)
+
+        if spacing_hint is not None:
+            # the divisors of the search below nearest the hint, so a hit gives the
+            # same spacing it would. a low-resolution hint may have settled on half
+            # the real spacing, so double goes first, like larger spacings do below
+            for spacing in (spacing_hint * 2, spacing_hint):
+                spacing_div = max(round(spacing0 / spacing), 1)
+                if (
+                    spacing_div in spacing_divs
+                    and (ret := check_spacing(spacing0 / spacing_div)) is not None
+                ):
+                    return ret
+
+        for spacing_div in spacing_divs:
+            if (ret := check_spacing(spacing0 / spacing_div)) is not None:
+                return ret
         raise GeomNoGoodSpacingException()
 
     spacing_o, offset_o_u, offset_o_l = find_spacing()
@@ -832,11 +1455,30 @@ def make_glyph_geometry(
     )
 
 
+# inverse of `glyph_geometry_prim` in `find_glyphs_stages`; see also
+# `makeFullGlyphGeometry` in the web app
+def make_glyph_geometry_from_prim(prim: dict) -> GlyphGeometry:
+    a = np.deg2rad(prim["angle"])
+    grid1 = prim["size"] * np.array([np.cos(a), -np.sin(a)])
+    grid2 = prim["size"] * np.array([np.cos(a), np.sin(a)])
+    offset_u = np.array([prim["h_nudge"], -prim["upper"] - prim["size"]])
+    offset_l = np.array([prim["h_nudge"], prim["lower"] + prim["size"]])
+    return make_glyph_geometry(
+        int(prim["upscale"]),
+        int(prim["stroke_width"]),
+        grid1,
+        grid2,
+        offset_u,
+        offset_l,
+    )
+
+
 @dataclass
 class GlyphTemplates:
-    glyphs: NDArray_f32
+    # int16 once quantized by `quantize_templates`
+    glyphs: NDArray_f32 | NDArray_i16
     mask: npt.NDArray[np.bool_]
-    base: NDArray_f32
+    base: NDArray_f32 | NDArray_i16
 
 
 def make_templates(g: GlyphGeometry) -> GlyphTemplates:
@@ -915,9 +1557,102 @@ def make_templates(g: GlyphGeometry) -> GlyphTemplates:
     )
 
 
+# templates are drawn in 8 bits and blurred with OpenCV's fixed 3x3 Gaussian, whose
+# weights are sixteenths, so every value is a multiple of 1 / (255 * 16)
+TEMPLATE_QUANTUM = 255 * 16
+
+
+# exactly, as integers in units of `TEMPLATE_QUANTUM`
+def quantize_templates(templates: GlyphTemplates) -> GlyphTemplates:
+    def quantize(a: NDArray_f32) -> NDArray_i16:
+        return np.int16(np.rint(a * TEMPLATE_QUANTUM))
+
+    return GlyphTemplates(
+        glyphs=quantize(templates.glyphs),
+        mask=templates.mask,
+        base=quantize(templates.base),
+    )
+
+
+# the pixels of the template window where any template is nonzero, as flat indices
+# into the window, and relative to the window's corner in an image `image_width`
+# wide; nothing outside them can change a fit
+@dataclass
+class TemplateSupport:
+    window: npt.NDArray[np.intp]
+    image: npt.NDArray[np.intp]
+
+
+def template_support(
+    templates: GlyphTemplates, template_shape: tuple[int, int], image_width: int
+) -> TemplateSupport:
+    window = np.flatnonzero(np.any(templates.mask, axis=0) | (templates.base != 0))
+    rows, cols = np.divmod(window, template_shape[1])
+    return TemplateSupport(window=window, image=rows * image_width + cols)
+
+
+# the templates as vectors over `support`
+def compact_templates(
+    templates: GlyphTemplates, support: TemplateSupport
+) -> GlyphTemplates:
+    n = len(templates.glyphs)
+    return GlyphTemplates(
+        glyphs=templates.glyphs.reshape(n, -1)[:, support.window],
+        mask=templates.mask.reshape(n, -1)[:, support.window],
+        base=templates.base.reshape(-1)[support.window],
+    )
+
+
+# templates by exact geometry, least recently used first
+class TemplateCache:
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._templates: collections.OrderedDict[str, GlyphTemplates] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def get(self, geometry: GlyphGeometry) -> GlyphTemplates:
+        key = json.dumps(geometry.to_pod())
+        with self._lock:
+            if (templates := self._templates.get(key)) is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return templates
+            self.misses += 1
+        templates = make_templates(geometry)
+        with self._lock:
+            self._templates[key] = templates
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return templates
+
+    # the cached geometries, least recently used first
+    def geometries(self) -> list[GlyphGeometry]:
+        with self._lock:
+            keys = list(self._templates.keys())
+        return [GlyphGeometry.from_pod(json.loads(key)) for key in keys]
+
+
 def sort_baselines(
     stroke_width: int, baselines_spec: list[BaselineSpec]
 ) -> list[BaselineSpec]:
+    return [
+        bsln_spec
+        for line in group_baselines(stroke_width, baselines_spec)
+        for bsln_spec in line
+    ]
+
+
+# baselines grouped into lines of text, top to bottom, each sorted left to right
+def group_baselines(
+    stroke_width: int, baselines_spec: list[BaselineSpec]
+) -> list[list[BaselineSpec]]:
     blines_i = np.array(
         sorted(range(len(baselines_spec)), key=lambda i: baselines_spec[i].x)
     )
@@ -933,12 +1668,414 @@ def sort_baselines(
         blines_i = blines_i[~sel_mask]
         blines_ys = blines_ys[~sel_mask]
 
-    return [baselines_spec[i] for k in sorted(y_grouped.keys()) for i in y_grouped[k]]
+    return [[baselines_spec[i] for i in y_grouped[k]] for k in sorted(y_grouped.keys())]
+
+
+class GlyphFitDiagPod(typing.TypedDict):
+    score: float
+    margin: float
+    iterations: int
+    offset: tuple[int, int]
+    # the offset is on the edge of the search window, so `slop` may be too small
+    edge: bool
+    seconds: float
 
 
 class RecognizedGlyphPod(typing.TypedDict):
     origin: tuple[float, float]
     strokes: int
+    diag: typing.NotRequired[GlyphFitDiagPod]
+
+
+class GlyphGeometryFoundPod(typing.TypedDict):
+    geometry_prim: dict[str, typing.Any]
+    geometry: GlyphGeometryPod
+
+
+class GlyphLinePod(typing.TypedDict):
+    line: int
+    glyphs: list[RecognizedGlyphPod]
+
+
+class GlyphPreviewPod(typing.TypedDict):
+    geometry_prim: dict[str, typing.Any]
+    geometry: GlyphGeometryPod
+    glyphs: list[RecognizedGlyphPod]
+
+
+class RecognitionResultPod(typing.TypedDict):
+    geometry_prim: dict[str, typing.Any]
+    geometry: GlyphGeometryPod
+    glyphs: list[RecognizedGlyphPod]
+    lax: bool
+    degradations: list[str]
+
+
+# `findGlyphs` then `fitGlyphs`, retrying in lax mode on failure like the web worker
+# does; with `speculative`, through `find_glyphs_speculative` instead. a given `lax`
+# runs just that mode
+def recognize(
+    src_raw: NDArray_u8,
+    *,
+    lax: bool | None = None,
+    deadline: float | Deadline | None = None,
+    instrument: StageRecorder | None = None,
+    slop: int = 2,
+    workers: int | None = None,
+    speculative=False,
+) -> RecognitionResultPod:
+    if deadline is not None and not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline)
+    try:
+        try:
+            if speculative and lax is None:
+                found, lax = run_generator(
+                    find_glyphs_speculative(
+                        src_raw, deadline=deadline, instrument=instrument
+                    )
+                )
+            else:
+                found = run_generator(
+                    findGlyphs(
+                        src_raw,
+                        lax=bool(lax),
+                        deadline=deadline,
+                        instrument=instrument,
+                    )
+                )
+        except Exception:
+            if speculative or lax is not None:
+                raise
+            if deadline is not None and deadline.used() > DEADLINE_LAX_RETRY_SHARE:
+                deadline.degrade("no_lax_retry")
+                raise
+            lax = True
+            found = run_generator(
+                findGlyphs(src_raw, lax=True, deadline=deadline, instrument=instrument)
+            )
+    except Exception as e:
+        # there's no result to report them in, but they may explain the failure
+        e.degradations = [] if deadline is None else list(deadline.degradations)
+        raise
+    (
+        strokes_bordered,
+        glyph_geometry_prim,
+        glyph_geometry,
+        glyph_templates,
+        glyph_origins_raw,
+    ) = found
+    glyphs = list(
+        fitGlyphs(
+            strokes_bordered,
+            glyph_geometry,
+            glyph_templates,
+            glyph_origins_raw,
+            slop=slop,
+            deadline=deadline,
+            instrument=instrument,
+            workers=workers,
+        )
+    )
+    return RecognitionResultPod(
+        geometry_prim=glyph_geometry_prim,
+        geometry=glyph_geometry.to_pod(),
+        glyphs=glyphs,
+        lax=bool(lax),
+        degradations=[] if deadline is None else list(deadline.degradations),
+    )
+
+
+# `roi` is (x, y, width, height) in source pixels; glyph origins are in upscaled
+# pixels of the whole image, like everywhere else
+class BlockResultPod(typing.TypedDict):
+    roi: tuple[int, int, int, int]
+    geometry_prim: dict[str, typing.Any] | None
+    geometry: GlyphGeometryPod | None
+    glyphs: list[RecognizedGlyphPod]
+    lax: bool
+    error: str | None
+
+
+# for pages with several blocks of text at different scales: each block gets its own
+# geometry, solved and fitted independently and concurrently, and a block that fails
+# doesn't take the others down with it
+def recognize_blocks(
+    src_raw: NDArray_u8,
+    *,
+    upscale=3,
+    slop: int = 2,
+    workers: int | None = None,
+    template_cache: TemplateCache | None = None,
+) -> list[BlockResultPod]:
+    template_cache = template_cache if template_cache is not None else TemplateCache()
+
+    def recognize_block(roi) -> BlockResultPod:
+        x, y, w, h = roi
+        crop = src_raw[y : y + h, x : x + w]
+        lax = False
+        try:
+            try:
+                found = run_generator(
+                    find_glyphs_stages(crop, upscale, template_cache=template_cache)
+                )
+            except Exception:
+                lax = True
+                found = run_generator(
+                    find_glyphs_stages(
+                        crop, upscale, lax=True, template_cache=template_cache
+                    )
+                )
+        except Exception as e:
+            return BlockResultPod(
+                roi=roi,
+                geometry_prim=None,
+                geometry=None,
+                glyphs=[],
+                lax=lax,
+                error=type(e).__name__,
+            )
+        strokes_bordered, prim, geometry, templates, origins, _lines = found
+        crop_offset = np.array([x, y]) * upscale
+        return BlockResultPod(
+            roi=roi,
+            geometry_prim=prim,
+            geometry=geometry.to_pod(),
+            glyphs=[
+                RecognizedGlyphPod(
+                    origin=tuple(map(int, np.add(glyph["origin"], crop_offset))),
+                    strokes=glyph["strokes"],
+                )
+                for glyph in fitGlyphs(
+                    strokes_bordered, geometry, templates, origins, slop=slop
+                )
+            ],
+            lax=lax,
+            error=None,
+        )
+
+    rois = find_text_blocks(src_raw, upscale)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(recognize_block, rois))
+
+
+# groups connected strokes by their own stroke width, finds the baselines of each
+# group, and clusters nearby baselines into blocks; distances are in stroke widths
+def find_text_blocks(
+    src_raw: NDArray_u8,
+    upscale=3,
+    *,
+    width_ratio=1.25,
+    link_h=12,
+    link_v=30,
+    margin_h=4,
+    margin_above=14,
+    margin_below=16,
+    min_length=8,
+) -> list[tuple[int, int, int, int]]:
+    src, upscale = preprocess(src_raw, upscale)
+    strokes_raw = segmentThreshold(src, upscale)
+    del src
+    medialAxis, _medialAxisMask = mkMedialAxis(strokes_raw)
+
+    n_comp, cc_labels, cc_stats, _c = cv2.connectedComponentsWithStats(
+        strokes_raw, connectivity=4, ltype=cv2.CV_16U
+    )
+    comp_widths = dict()
+    for i in range(1, n_comp):
+        roi = cv2_cc_get_roi(cc_stats, i)
+        comp_medial_axis = medialAxis[roi] * (cc_labels[roi] == i)
+        if np.max(comp_medial_axis) < 2:
+            continue
+        comp_widths[i] = findStrokeWidth(comp_medial_axis)
+
+    # runs of similar stroke widths
+    width_groups: list[list[int]] = []
+    for width in sorted(set(comp_widths.values())):
+        if width_groups and width <= width_groups[-1][0] * width_ratio:
+            width_groups[-1].append(width)
+        else:
+            width_groups.append([width])
+
+    blocks = []
+    for widths in width_groups:
+        comps = [i for i, width in comp_widths.items() if width in widths]
+        strokes = np.uint8(np.isin(cc_labels, comps))
+        group_medial_axis = medialAxis * strokes
+        stroke_width = findStrokeWidth(group_medial_axis)
+        strokes = clean_strokes(strokes, group_medial_axis, stroke_width)
+        _baselines, baselines_spec = find_baselines(
+            upscale, stroke_width, strokes, np.float32(strokes)
+        )
+        baselines_spec = [b for b in baselines_spec if b.length > 0]
+
+        # single linkage over nearby baselines
+        parent = list(range(len(baselines_spec)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, a in enumerate(baselines_spec):
+            for j in range(i):
+                b = baselines_spec[j]
+                gap_h = max(a.x - (b.x + b.length), b.x - (a.x + a.length), 0)
+                if (
+                    gap_h <= link_h * stroke_width
+                    and abs(a.y - b.y) <= link_v * stroke_width
+                ):
+                    parent[find(i)] = find(j)
+
+        clusters: dict[int, list[BaselineSpec]] = dict()
+        for i, b in enumerate(baselines_spec):
+            clusters.setdefault(find(i), []).append(b)
+        for cluster in clusters.values():
+            if sum(b.length for b in cluster) < min_length * stroke_width:
+                continue
+            x0 = min(b.x for b in cluster) - margin_h * stroke_width
+            x1 = max(b.x + b.length for b in cluster) + margin_h * stroke_width
+            y0 = min(b.y for b in cluster) - margin_above * stroke_width
+            y1 = max(b.y for b in cluster) + margin_below * stroke_width
+            x0 = max(math.floor(x0 / upscale), 0)
+            y0 = max(math.floor(y0 / upscale), 0)
+            x1 = min(math.ceil(x1 / upscale), src_raw.shape[1])
+            y1 = min(math.ceil(y1 / upscale), src_raw.shape[0])
+            blocks.append((x0, y0, x1 - x0, y1 - y0))
+
+    # reading order
+    return sorted(blocks, key=lambda b: (b[1], b[0]))
+
+
+# `engine` picks how windows are scored against templates:
+#   "float": float32 strokes and templates
+#   "int": uint8 strokes and `quantize_templates`, scored exactly in integers; the
+#     same glyphs as "float" on the test inputs. a quarter of the memory traffic, and
+#     the fastest with `jit`, but NumPy's integer einsum is slow without it
+#   "sparse", "sparse_int": like "float" and "int", but only the pixels in
+#     `template_support` are gathered and scored
+# no `engine` is "float". "auto" is what `trunic_ocr_core.autotune` found fastest on
+# this host, or "float" if it hasn't been run there; its tuned `workers` apply when
+# none are given, unless there's a deadline, since only serial fitting adapts slop
+FIT_ENGINES = ("float", "int", "sparse", "sparse_int")
+
+
+# the tuning file `trunic_ocr_core.autotune` writes and `fitGlyphs` reads
+def fit_tuning_path() -> str:
+    return os.environ.get("TRUNIC_OCR_AUTOTUNE") or os.path.join(
+        os.path.expanduser("~"), ".cache", "trunic-ocr", "autotune.json"
+    )
+
+
+# tuned configurations are per host: its name, architecture, cores, and whether the
+# compiled kernels are in use
+def fit_tuning_host() -> str:
+    jit = "jit" if jit_kernels() is not None else "nojit"
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}/{jit}"
+
+
+# and per power of two of the template's pixel count
+def template_size_bucket(glyph_template_shape: tuple[int, int]) -> int:
+    return int(glyph_template_shape[0] * glyph_template_shape[1]).bit_length()
+
+
+# {host: {bucket: config}}; empty if there's no tuning file or it can't be read
+@functools.cache
+def load_fit_tuning(path: str) -> dict[str, dict[str, dict[str, typing.Any]]]:
+    try:
+        with open(path, "rb") as f:
+            tuning = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    return tuning if isinstance(tuning, dict) else dict()
+
+
+# the tuned `engine` and `workers` for this host, from the nearest
+# bucket that has been tuned
+def tuned_fit_config(
+    glyph_template_shape: tuple[int, int],
+) -> dict[str, typing.Any] | None:
+    buckets = load_fit_tuning(fit_tuning_path()).get(fit_tuning_host())
+    if not buckets:
+        return None
+    bucket = template_size_bucket(glyph_template_shape)
+    return buckets[min(buckets, key=lambda b: (abs(int(b) - bucket), int(b)))]
+
+
+type GreedyFit = tuple[npt.NDArray[np.bool_], NDArray_i32, GreedyFitStats]
+
+
+# earlier `fit_glyph_greedy` results for `fitGlyphs`, so a region that was already
+# fitted isn't fitted again. the key covers the templates, the offsets, and every
+# pixel any offset's window reads, bit-packed when the strokes are binary, as
+# `findGlyphs` makes them; so a hit is exactly what fitting would give.
+# only useful across documents: repeated glyphs within one page never match
+# exactly (subpixel placement, neighbours in the window), so a memo used for a
+# single `fitGlyphs` call only adds hashing. keep one alive across calls when the
+# same pages or screenshots come back, e.g. in a server or batch job. may be shared
+# across threads; the least recently used entries are dropped past `max_size`
+class FitMemo:
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fits: collections.OrderedDict[bytes, GreedyFit] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fits)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    # for fitting `glyph_templates` in `strokes_bordered`: takes a glyph's bordered
+    # origin, the offsets and a function that fits it, and returns the fit
+    def bind(
+        self,
+        strokes_bordered: NDArray_f32 | NDArray_u8,
+        glyph_templates: GlyphTemplates,
+        glyph_template_shape: tuple[int, int],
+    ) -> typing.Callable[
+        [NDArray_i32, NDArray_i32, typing.Callable[[], GreedyFit]], GreedyFit
+    ]:
+        h = hashlib.blake2b(digest_size=16)
+        for a in (glyph_templates.glyphs, glyph_templates.mask, glyph_templates.base):
+            h.update(json.dumps([a.dtype.str, a.shape]).encode())
+            h.update(np.ascontiguousarray(a).data)
+        binary = bool(np.all((strokes_bordered == 0) | (strokes_bordered == 1)))
+        tmpl_h, tmpl_w = glyph_template_shape
+
+        def memoized(origin_bo, all_template_offsets, fit):
+            lo = origin_bo + all_template_offsets.min(axis=0)
+            hi = origin_bo + all_template_offsets.max(axis=0)
+            window = strokes_bordered[lo[1] : hi[1] + tmpl_h, lo[0] : hi[0] + tmpl_w]
+            k = h.copy()
+            k.update(np.ascontiguousarray(all_template_offsets, dtype=np.int32).data)
+            k.update(np.array(window.shape, dtype=np.int32).data)
+            k.update(
+                np.packbits(window != 0).data
+                if binary
+                else np.ascontiguousarray(window).data
+            )
+            key = k.digest()
+            with self._lock:
+                if (found := self._fits.get(key)) is not None:
+                    self._fits.move_to_end(key)
+                    self.hits += 1
+                    return found
+                self.misses += 1
+            found = fit()
+            with self._lock:
+                self._fits[key] = found
+                while len(self._fits) > self.max_size:
+                    self._fits.popitem(last=False)
+            return found
+
+        return memoized
 
 
 def fitGlyphs(
@@ -947,7 +2084,42 @@ def fitGlyphs(
     glyph_templates: GlyphTemplates,
     glyph_origins_raw: NDArray_i32 | list[int],
     slop: int = 2,
+    deadline: Deadline | None = None,
+    instrument: StageRecorder | None = None,
+    diagnostics=False,
+    workers: int | None = None,
+    engine: str | None = None,
+    memo: FitMemo | None = None,
 ) -> typing.Generator[RecognizedGlyphPod, typing.Any, None]:
+    if engine is None:
+        engine = "float"
+    elif engine == "auto":
+        tuned = tuned_fit_config(glyph_geometry.glyph_template_shape) or dict()
+        engine = tuned.get("engine", "float")
+        if engine not in FIT_ENGINES:
+            # tuned by another version
+            engine, tuned = "float", dict()
+        if workers is None and deadline is None:
+            workers = tuned.get("workers")
+    if engine not in FIT_ENGINES:
+        raise ValueError(f"unknown engine {engine!r}")
+    if engine in ("int", "sparse_int"):
+        strokes_bordered = strokes_bordered.astype(np.uint8, copy=False)
+        glyph_templates = quantize_templates(glyph_templates)
+    support = None
+    if engine in ("sparse", "sparse_int"):
+        strokes_bordered = np.ascontiguousarray(strokes_bordered)
+        support = template_support(
+            glyph_templates,
+            glyph_geometry.glyph_template_shape,
+            strokes_bordered.shape[1],
+        )
+        glyph_templates = compact_templates(glyph_templates, support)
+    memoized = None
+    if memo is not None:
+        memoized = memo.bind(
+            strokes_bordered, glyph_templates, glyph_geometry.glyph_template_shape
+        )
     upscale = glyph_geometry.upscale
     stroke_width = glyph_geometry.stroke_width
     glyph_template_origin = glyph_geometry.glyph_template_origin
@@ -962,8 +2134,10 @@ def fitGlyphs(
         - (upscale * slop + 1) // 2
     )
 
-    for g in glyph_origins_raw:
-        yield fit_glyph_one(
+    def fit_one(g, all_template_offsets):
+        if instrument is not None:
+            instrument.begin("fit_glyph")
+        glyph = fit_glyph_one(
             strokes_bordered,
             stroke_width,
             glyph_template_origin,
@@ -973,7 +2147,142 @@ def fitGlyphs(
             glyph_template_base,
             all_template_offsets,
             g,
+            diagnostics=diagnostics,
+            support=support,
+            memoized=memoized,
+        )
+        if instrument is not None:
+            instrument.end(offsets=len(all_template_offsets))
+        return glyph
+
+    if workers is not None and workers > 1:
+        yield from fit_glyphs_threaded(
+            lambda g: fit_one(g, all_template_offsets),
+            glyph_origins_raw,
+            workers,
+            deadline,
         )
+        return
+
+    fit_start = time.perf_counter()
+    for i, g in enumerate(glyph_origins_raw):
+        if deadline is not None:
+            if deadline.remaining() <= 0:
+                deadline.degrade("partial_glyphs")
+                return
+            # at the current pace the remaining glyphs won't make it
+            per_glyph = (time.perf_counter() - fit_start) / max(i, 1)
+            if (
+                slop > 1
+                and per_glyph * (len(glyph_origins_raw) - i) > deadline.remaining()
+            ):
+                deadline.degrade("reduced_slop")
+                slop = 1
+                all_template_offsets = (
+                    np.dstack(np.mgrid[: upscale + 1, : upscale + 1]).reshape(-1, 2)
+                    - (upscale + 1) // 2
+                )
+        yield fit_one(g, all_template_offsets)
+
+
+# fits contiguous chunks of glyphs on a thread pool and yields them in order. fitting
+# only reads the shared arrays, and spends most of its time in NumPy with the GIL
+# released. a deadline only truncates here; there is no pace to adapt slop to
+def fit_glyphs_threaded(
+    fit_one: typing.Callable[[NDArray_i32], RecognizedGlyphPod],
+    glyph_origins_raw: NDArray_i32,
+    workers: int,
+    deadline: Deadline | None = None,
+) -> typing.Generator[RecognizedGlyphPod, typing.Any, None]:
+    def fit_chunk(chunk):
+        glyphs = []
+        for g in chunk:
+            if deadline is not None and deadline.remaining() <= 0:
+                break
+            glyphs.append(fit_one(g))
+        return glyphs
+
+    # a few chunks per worker, so one slow chunk doesn't hold up the rest
+    n_chunks = max(min(len(glyph_origins_raw), workers * 4), 1)
+    chunks = np.array_split(glyph_origins_raw, n_chunks)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(fit_chunk, chunk) for chunk in chunks]
+        try:
+            for chunk, future in zip(chunks, futures):
+                glyphs = future.result()
+                yield from glyphs
+                if len(glyphs) < len(chunk):
+                    assert deadline is not None
+                    deadline.degrade("partial_glyphs")
+                    return
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+# one record per glyph, packed: origin as in `RecognizedGlyphPod`, and the strokes
+# as a little-endian bit set, bit `i` being stroke `i`
+GLYPHS_DTYPE = np.dtype([("origin", np.int32, (2,)), ("strokes", np.uint16)])
+GLYPHS_SCORED_DTYPE = np.dtype(
+    [("origin", np.int32, (2,)), ("strokes", np.uint16), ("score", np.float32)]
+)
+
+
+# all glyphs at once as a structured array, which exposes its records through the
+# buffer protocol; with `score`, includes the fit score from the diagnostics
+def fitGlyphsArray(
+    strokes_bordered: NDArray_f32,
+    glyph_geometry: GlyphGeometry,
+    glyph_templates: GlyphTemplates,
+    glyph_origins_raw: NDArray_i32 | list[int],
+    slop: int = 2,
+    *,
+    score=False,
+    deadline: Deadline | None = None,
+    instrument: StageRecorder | None = None,
+    workers: int | None = None,
+    engine: str | None = None,
+    memo: FitMemo | None = None,
+) -> np.ndarray:
+    return glyphs_to_array(
+        fitGlyphs(
+            strokes_bordered,
+            glyph_geometry,
+            glyph_templates,
+            glyph_origins_raw,
+            slop=slop,
+            deadline=deadline,
+            instrument=instrument,
+            diagnostics=score,
+            workers=workers,
+            engine=engine,
+            memo=memo,
+        ),
+        score=score,
+    )
+
+
+def glyphs_to_array(
+    glyphs: typing.Iterable[RecognizedGlyphPod], score=False
+) -> np.ndarray:
+    glyphs = list(glyphs)
+    arr = np.empty(len(glyphs), dtype=GLYPHS_SCORED_DTYPE if score else GLYPHS_DTYPE)
+    for rec, glyph in zip(arr, glyphs):
+        rec["origin"] = glyph["origin"]
+        rec["strokes"] = glyph["strokes"][0] | glyph["strokes"][1] << 8
+        if score:
+            rec["score"] = glyph["diag"]["score"]
+    return arr
+
+
+def array_to_glyphs(arr: np.ndarray) -> list[RecognizedGlyphPod]:
+    return [
+        RecognizedGlyphPod(
+            origin=tuple(map(int, rec["origin"])),
+            strokes=(int(rec["strokes"]) & 0xFF, int(rec["strokes"]) >> 8),
+        )
+        for rec in arr
+    ]
 
 
 def fit_glyph_one(
@@ -986,52 +2295,399 @@ def fit_glyph_one(
     glyph_template_base,
     all_template_offsets: NDArray_i32,
     glyph_origin_raw: NDArray_i32,
+    diagnostics=False,
+    support: TemplateSupport | None = None,
+    memoized=None,
 ) -> RecognizedGlyphPod:
     def rect_to_slice(p, s):
         return (slice(p[1], p[1] + s[0]), slice(p[0], p[0] + s[1]))
 
-    def gen_next_templates(strokes, template):
-        stroke_is = np.nonzero(~strokes)[0]
-        n = len(stroke_is)
-        next_strokes = np.broadcast_to(strokes, (n, *strokes.shape)).copy()
-        next_templates = np.broadcast_to(template, (n, *template.shape)).copy()
-        next_strokes[np.indices([n]), stroke_is] = True
-        m = glyph_template_mask[stroke_is]
-        next_templates[m] = np.fmax(next_templates[m], glyph_template[stroke_is][m])
-        return next_strokes, next_templates
-
+    t_start = time.perf_counter()
     glyph_origin_raw_bo = glyph_origin_raw - glyph_template_origin + border_offset
-    glyph_all_offsets = [
-        strokes_bordered[rect_to_slice(glyph_origin_raw_bo + o, glyph_template_shape)]
-        for o in all_template_offsets
-    ]
-    glyph_all_offsets = np.array(glyph_all_offsets)
+
+    def fit():
+        if support is not None:
+            # the templates are compacted to `support` too
+            width = strokes_bordered.shape[1]
+            starts = (glyph_origin_raw_bo + all_template_offsets) @ [1, width]
+            glyph_all_offsets = strokes_bordered.reshape(-1)[
+                starts[:, np.newaxis] + support.image
+            ]
+        else:
+            glyph_all_offsets = [
+                strokes_bordered[
+                    rect_to_slice(glyph_origin_raw_bo + o, glyph_template_shape)
+                ]
+                for o in all_template_offsets
+            ]
+            glyph_all_offsets = np.array(glyph_all_offsets)
+        return fit_glyph_greedy(
+            glyph_all_offsets,
+            glyph_template,
+            glyph_template_mask,
+            glyph_template_base,
+            all_template_offsets,
+        )
+
+    if memoized is not None:
+        cur_strokes, cur_offset, stats = memoized(
+            glyph_origin_raw_bo, all_template_offsets, fit
+        )
+    else:
+        cur_strokes, cur_offset, stats = fit()
+    ret = RecognizedGlyphPod(
+        strokes=tuple(map(int, np.packbits(cur_strokes, bitorder="little"))),
+        origin=tuple(map(int, glyph_origin_raw + cur_offset)),
+    )
+    if diagnostics:
+        ret["diag"] = make_fit_diag(
+            stats, cur_offset, all_template_offsets, time.perf_counter() - t_start
+        )
+    return ret
+
+
+@dataclass
+class GreedyFitStats:
+    fit: float
+    # best fit of any other stroke set the search looked at when it settled
+    runner_up: float
+    iterations: int
+
+
+# `glyph_all_offsets` holds the glyph's window at each of `all_template_offsets`
+def fit_glyph_greedy(
+    glyph_all_offsets,
+    glyph_template,
+    glyph_template_mask,
+    glyph_template_base,
+    all_template_offsets: NDArray_i32,
+) -> tuple[npt.NDArray[np.bool_], NDArray_i32, GreedyFitStats]:
+    # quantized templates and uint8 windows are scored exactly, in integers
+    exact = np.issubdtype(glyph_template.dtype, np.integer)
+    if (jit := jit_kernels()) is not None:
+        strokes, offset_i, fit, runner_up, iterations = jit.fit_greedy(
+            np.ascontiguousarray(glyph_all_offsets),
+            glyph_template,
+            glyph_template_mask,
+            glyph_template_base,
+            np.int64(0) if exact else 0.0,
+        )
+        return (
+            strokes,
+            all_template_offsets[offset_i],
+            GreedyFitStats(
+                fit=float(fit), runner_up=float(runner_up), iterations=iterations
+            ),
+        )
+
+    # pixels are (y, x), or flat once compacted by `compact_templates`
+    px = "kl" if glyph_all_offsets.ndim == 3 else "k"
 
     def check_templates(templates):
         tmpl_max0 = np.fmax(templates, 0)
         best_offsets_i = np.argmax(
-            np.einsum("ikl,jkl->ji", glyph_all_offsets, tmpl_max0), axis=1
+            np.einsum(
+                f"i{px},j{px}->ji",
+                glyph_all_offsets,
+                tmpl_max0,
+                dtype=np.int64 if exact else None,
+            ),
+            axis=1,
         )
         best_offsets = all_template_offsets[best_offsets_i]
         glyphs = glyph_all_offsets[best_offsets_i]
         return (
-            np.einsum("ijk,ijk->i", glyphs, templates) / np.sum(tmpl_max0, axis=(1, 2)),
+            np.einsum(
+                f"i{px},i{px}->i", glyphs, templates, dtype=np.int64 if exact else None
+            )
+            / np.sum(tmpl_max0, axis=tuple(range(1, tmpl_max0.ndim))),
             best_offsets,
         )
 
     cur_strokes = np.zeros(len(glyph_template), dtype=np.bool_)
     cur_template = glyph_template_base.copy()
     (cur_fit,), (cur_offset,) = check_templates(cur_template[np.newaxis, ...])
+    runner_up = -np.inf
+    iterations = 0
     for _i in range(len(glyph_template)):
-        next_strokes, next_templates = gen_next_templates(cur_strokes, cur_template)
+        next_strokes, next_templates = gen_next_templates(
+            glyph_template, glyph_template_mask, cur_strokes, cur_template
+        )
         fits, offsets = check_templates(next_templates)
+        iterations += 1
         next_i = np.argmax(fits)
         if fits[next_i] < cur_fit:
+            runner_up = max(runner_up, fits[next_i])
             break
+        runner_up = np.max(np.delete(fits, next_i), initial=cur_fit)
         cur_strokes = next_strokes[next_i]
         cur_template = next_templates[next_i]
         cur_fit = fits[next_i]
         cur_offset = offsets[next_i]
+    return (
+        cur_strokes,
+        cur_offset,
+        GreedyFitStats(
+            fit=float(cur_fit), runner_up=float(runner_up), iterations=iterations
+        ),
+    )
+
+
+def make_fit_diag(
+    stats: GreedyFitStats,
+    offset: NDArray_i32,
+    all_template_offsets: NDArray_i32,
+    seconds: float,
+) -> GlyphFitDiagPod:
+    return GlyphFitDiagPod(
+        score=stats.fit,
+        margin=stats.fit - stats.runner_up,
+        iterations=stats.iterations,
+        offset=tuple(map(int, offset)),
+        edge=bool(
+            np.any(offset == all_template_offsets.min(axis=0))
+            or np.any(offset == all_template_offsets.max(axis=0))
+        ),
+        seconds=seconds,
+    )
+
+
+def summarize_fit_diagnostics(
+    glyphs: typing.Iterable[RecognizedGlyphPod],
+) -> dict[str, typing.Any]:
+    diags = [g["diag"] for g in glyphs]
+
+    def describe(values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return None
+        return dict(
+            mean=float(np.mean(values)),
+            min=float(np.min(values)),
+            median=float(np.median(values)),
+            max=float(np.max(values)),
+        )
+
+    offsets = np.array([d["offset"] for d in diags], dtype=np.int32).reshape(-1, 2)
+    # chebyshev distance of the chosen offset from the unadjusted origin
+    offset_radius = np.max(np.abs(offsets), axis=1)
+    return dict(
+        glyphs=len(diags),
+        score=describe([d["score"] for d in diags]),
+        margin=describe([d["margin"] for d in diags]),
+        iterations=describe([d["iterations"] for d in diags]),
+        seconds=describe([d["seconds"] for d in diags]),
+        total_seconds=float(sum(d["seconds"] for d in diags)),
+        edge_hit_rate=float(np.mean([d["edge"] for d in diags])) if diags else 0.0,
+        offset_radius_counts=np.bincount(offset_radius).tolist(),
+    )
+
+
+def gen_next_templates(
+    glyph_template: NDArray_f32,
+    glyph_template_mask: npt.NDArray[np.bool_],
+    strokes: npt.NDArray[np.bool_],
+    template: NDArray_f32,
+) -> tuple[npt.NDArray[np.bool_], NDArray_f32]:
+    stroke_is = np.nonzero(~strokes)[0]
+    n = len(stroke_is)
+    next_strokes = np.broadcast_to(strokes, (n, *strokes.shape)).copy()
+    next_templates = np.broadcast_to(template, (n, *template.shape)).copy()
+    next_strokes[np.indices([n]), stroke_is] = True
+    m = glyph_template_mask[stroke_is]
+    next_templates[m] = np.fmax(next_templates[m], glyph_template[stroke_is][m])
+    return next_strokes, next_templates
+
+
+# `score_templates[0]` is the positive part of the base template, and `[1:]` how much
+# adding each single stroke raises it; their correlation maps over `strokes_bordered`
+# are computed a `tile_size` square of positions at a time, when `fitGlyphAt` first
+# looks into one, and kept for later queries, which are then lookups. a tile takes
+# `4 * 13 * tile_size**2` bytes, 52 KiB by default, and the least recently used are
+# dropped past `max_tiles`, so at most ~52 MiB: all of them at once would be a
+# float32 map the size of the image per template, ~180 MiB for a 964x497
+# screenshot. a tile costs about what correlating around one glyph does; larger
+# ones cover more glyphs, but mostly the space between. may be shared across threads
+class GlyphScoreMaps:
+    def __init__(
+        self,
+        upscale: int,
+        strokes_bordered: NDArray_f32,
+        border_offset: int,
+        glyph_template_origin: NDArray_i32,
+        glyph_template_shape: tuple[int, int],
+        glyph_templates: GlyphTemplates,
+        score_templates: NDArray_f32,
+        tile_size=32,
+        max_tiles=1024,
+    ):
+        self.upscale = upscale
+        self.strokes_bordered = strokes_bordered
+        self.border_offset = border_offset
+        self.glyph_template_origin = glyph_template_origin
+        self.glyph_template_shape = glyph_template_shape
+        self.glyph_templates = glyph_templates
+        self.score_templates = score_templates
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.hits = 0
+        self.misses = 0
+        self._tiles: collections.OrderedDict[tuple[int, int], NDArray_f32] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    # (y, x) of the positions a template's corner can take
+    @property
+    def shape(self) -> tuple[int, int]:
+        h, w = self.glyph_template_shape
+        return (
+            self.strokes_bordered.shape[0] - h + 1,
+            self.strokes_bordered.shape[1] - w + 1,
+        )
+
+    # every map at each (x, y) of `pos`, as (maps, positions)
+    def lookup(self, pos: NDArray_i32) -> NDArray_f32:
+        tile_ys = pos[:, 1] // self.tile_size
+        tile_xs = pos[:, 0] // self.tile_size
+        scores = np.empty((len(self.score_templates), len(pos)), dtype=np.float32)
+        for ty, tx in set(zip(tile_ys.tolist(), tile_xs.tolist())):
+            i = np.flatnonzero((tile_ys == ty) & (tile_xs == tx))
+            rel = pos[i] - [tx * self.tile_size, ty * self.tile_size]
+            scores[:, i] = self._tile(ty, tx)[:, rel[:, 1], rel[:, 0]]
+        return scores
+
+    def _tile(self, ty: int, tx: int) -> NDArray_f32:
+        key = (ty, tx)
+        with self._lock:
+            if (tile := self._tiles.get(key)) is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+        h, w = self.glyph_template_shape
+        map_h, map_w = self.shape
+        y0, x0 = ty * self.tile_size, tx * self.tile_size
+        y1 = min(y0 + self.tile_size, map_h)
+        x1 = min(x0 + self.tile_size, map_w)
+        region = self.strokes_bordered[y0 : y1 + h - 1, x0 : x1 + w - 1]
+        tile = np.array(
+            [cv2.matchTemplate(region, t, cv2.TM_CCORR) for t in self.score_templates]
+        )
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+
+def prepareScoreMaps(
+    strokes_bordered: NDArray_f32,
+    glyph_geometry: GlyphGeometry,
+    glyph_templates: GlyphTemplates,
+    *,
+    tile_size=32,
+    max_tiles=1024,
+) -> GlyphScoreMaps:
+    base_max0 = np.fmax(glyph_templates.base, 0)
+    _s, single_templates = gen_next_templates(
+        glyph_templates.glyphs,
+        glyph_templates.mask,
+        np.zeros(len(glyph_templates.glyphs), dtype=np.bool_),
+        glyph_templates.base,
+    )
+    strokes_bordered = np.float32(strokes_bordered)
+    score_templates = np.concatenate(
+        [base_max0[np.newaxis], np.fmax(single_templates, 0) - base_max0]
+    )
+    return GlyphScoreMaps(
+        upscale=glyph_geometry.upscale,
+        strokes_bordered=strokes_bordered,
+        border_offset=glyph_geometry.stroke_width,
+        glyph_template_origin=glyph_geometry.glyph_template_origin,
+        glyph_template_shape=glyph_geometry.glyph_template_shape,
+        glyph_templates=glyph_templates,
+        score_templates=score_templates,
+        tile_size=tile_size,
+        max_tiles=max_tiles,
+    )
+
+
+# same greedy search as `fit_glyph_one`, but candidate offsets are ranked by summing
+# the single-stroke score maps (which ignores where strokes overlap), and only the
+# best `refine_offsets` of them are scored exactly against the composed template
+def fitGlyphAt(
+    score_maps: GlyphScoreMaps,
+    glyph_origin_raw: NDArray_i32 | list[int],
+    slop: int = 2,
+    refine_offsets: int = 6,
+) -> RecognizedGlyphPod:
+    glyph_template = score_maps.glyph_templates.glyphs
+    glyph_template_mask = score_maps.glyph_templates.mask
+    glyph_template_base = score_maps.glyph_templates.base
+
+    glyph_origin_raw = np.asarray(glyph_origin_raw, dtype=np.int32).reshape(2)
+    n_offsets = score_maps.upscale * slop + 1
+    all_template_offsets = (
+        np.dstack(np.mgrid[:n_offsets, :n_offsets]).reshape(-1, 2) - n_offsets // 2
+    )
+    p0 = glyph_origin_raw - score_maps.glyph_template_origin + score_maps.border_offset
+    pos = p0 + all_template_offsets
+    map_h, map_w = score_maps.shape
+    if not (
+        np.all(pos >= 0) and np.all(pos[:, 0] < map_w) and np.all(pos[:, 1] < map_h)
+    ):
+        raise ValueError("glyph origin too close to the edge of the image")
+    map_scores = score_maps.lookup(pos)
+
+    h, w = score_maps.glyph_template_shape
+    lo = pos.min(axis=0)
+    hi = pos.max(axis=0)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        score_maps.strokes_bordered[lo[1] : hi[1] + h, lo[0] : hi[0] + w], (h, w)
+    )
+    pos_rel = pos - lo
+    refine_offsets = min(refine_offsets, len(all_template_offsets))
+
+    def check_templates(approx_scores, templates):
+        cand_i = np.argpartition(approx_scores, -refine_offsets, axis=1)[
+            :, -refine_offsets:
+        ]
+        cand_p = pos_rel[cand_i]
+        cand_glyphs = windows[cand_p[..., 1], cand_p[..., 0]]
+        tmpl_max0 = np.fmax(templates, 0)
+        best_j = np.argmax(np.einsum("ijkl,ikl->ij", cand_glyphs, tmpl_max0), axis=1)
+        best_offsets_i = np.take_along_axis(cand_i, best_j[:, np.newaxis], 1)[:, 0]
+        glyphs = cand_glyphs[np.arange(len(templates)), best_j]
+        return (
+            np.einsum("ijk,ijk->i", glyphs, templates) / np.sum(tmpl_max0, axis=(1, 2)),
+            all_template_offsets[best_offsets_i],
+        )
+
+    cur_strokes = np.zeros(len(glyph_template), dtype=np.bool_)
+    cur_template = glyph_template_base.copy()
+    cur_scores = map_scores[0]
+    (cur_fit,), (cur_offset,) = check_templates(
+        cur_scores[np.newaxis, ...], cur_template[np.newaxis, ...]
+    )
+    for _i in range(len(glyph_template)):
+        next_strokes, next_templates = gen_next_templates(
+            glyph_template, glyph_template_mask, cur_strokes, cur_template
+        )
+        stroke_is = np.nonzero(~cur_strokes)[0]
+        next_scores = cur_scores + map_scores[1 + stroke_is]
+        fits, offsets = check_templates(next_scores, next_templates)
+        next_i = np.argmax(fits)
+        if fits[next_i] < cur_fit:
+            break
+        cur_strokes = next_strokes[next_i]
+        cur_template = next_templates[next_i]
+        cur_scores = next_scores[next_i]
+        cur_fit = fits[next_i]
+        cur_offset = offsets[next_i]
     return RecognizedGlyphPod(
         strokes=tuple(map(int, np.packbits(cur_strokes, bitorder="little"))),
         origin=tuple(map(int, glyph_origin_raw + cur_offset)),
@@ -1048,6 +2704,66 @@ def fit_glyphs_batch(
     glyph_template_mask,
     glyph_template_base,
     glyph_origins,
+):
+    all_template_offsets = (
+        np.dstack(np.mgrid[: upscale * 2 + 1, : upscale * 2 + 1]).reshape(-1, 2)
+        - upscale
+    )
+    glyphs_all_offsets = extract_glyph_windows(
+        stroke_width,
+        strokes_bordered,
+        glyph_template_shape,
+        glyph_template_origin,
+        glyph_origins,
+        all_template_offsets,
+    )
+    current_templates_strokes, current_offset = yield from fit_windows_batch(
+        glyphs_all_offsets,
+        glyph_template,
+        glyph_template_mask,
+        glyph_template_base,
+        all_template_offsets,
+    )
+    return current_templates_strokes, current_offset + glyph_origins
+
+
+# every offset window of every glyph, (glyphs, offsets, h, w)
+def extract_glyph_windows(
+    stroke_width: int,
+    strokes_bordered: NDArray_f32,
+    glyph_template_shape: tuple[float, float],
+    glyph_template_origin,
+    glyph_origins,
+    all_template_offsets: NDArray_i32,
+) -> NDArray_f32:
+    def glyph_slice_par(offsets):
+        offsets = offsets + [stroke_width, stroke_width]
+        return [
+            strokes_bordered[offset[1] :, offset[0] :][
+                : glyph_template_shape[0], : glyph_template_shape[1]
+            ]
+            for offset in offsets
+        ]
+
+    return np.array(
+        [
+            glyph_slice_par(
+                all_template_offsets + (glyph_origin - glyph_template_origin)
+            )
+            for glyph_origin in glyph_origins
+        ],
+        dtype=np.float32,
+    ).reshape(-1, len(all_template_offsets), *glyph_template_shape)
+
+
+# the greedy fit of `fit_glyph_greedy`, vectorized over a batch of glyphs that share
+# templates, possibly from different images; returns the strokes and offsets
+def fit_windows_batch(
+    glyphs_all_offsets: NDArray_f32,
+    glyph_template,
+    glyph_template_mask,
+    glyph_template_base,
+    all_template_offsets: NDArray_i32,
 ):
     def gen_next_templates(templates_strokes, templates_data, popcount):
         # assert len(templates_strokes.shape) == 2
@@ -1077,11 +2793,6 @@ def fit_glyphs_batch(
     def np_index_par(a, indices, axis):
         return a[*np.ix_(*[np.arange(a.shape[i]) for i in range(axis)]), indices]
 
-    all_template_offsets = (
-        np.dstack(np.mgrid[: upscale * 2 + 1, : upscale * 2 + 1]).reshape(-1, 2)
-        - upscale
-    )
-
     def check_template(glyphs_all_offsets, templates_data):
         # what fresh dimensional hell have i created
         # assert len(glyphs_all_offsets.shape) == 4
@@ -1102,36 +2813,19 @@ def fit_glyphs_batch(
             best_offsets,
         )
 
-    def glyph_slice_par(offsets):
-        offsets = offsets + [stroke_width, stroke_width]
-        return [
-            strokes_bordered[offset[1] :, offset[0] :][
-                : glyph_template_shape[0], : glyph_template_shape[1]
-            ]
-            for offset in offsets
-        ]
-
-    glyphs_all_offsets = np.array(
-        [
-            glyph_slice_par(
-                all_template_offsets + (glyph_origin - glyph_template_origin)
-            )
-            for glyph_origin in glyph_origins
-        ],
-        dtype=np.float32,
-    )
+    n_glyphs = len(glyphs_all_offsets)
     current_templates_strokes = np.zeros(
-        (len(glyph_origins), len(glyph_template)), dtype=np.bool_
+        (n_glyphs, len(glyph_template)), dtype=np.bool_
     )
     current_templates_data = np.repeat(
-        glyph_template_base[np.newaxis, ...], len(glyph_origins), axis=0
+        glyph_template_base[np.newaxis, ...], n_glyphs, axis=0
     )
     current_fit, current_offset = check_template(
         glyphs_all_offsets, current_templates_data[:, np.newaxis]
     )
     current_fit = np.squeeze(current_fit, axis=1)
     current_offset = np.squeeze(current_offset, axis=1)
-    active_mask = np.full(len(glyph_origins), True, dtype=np.bool_)
+    active_mask = np.full(n_glyphs, True, dtype=np.bool_)
 
     for i in range(len(glyph_template)):
         next_templates_strokes, next_templates_data = gen_next_templates(
@@ -1162,7 +2856,29 @@ def fit_glyphs_batch(
         ]
         yield i
 
-    return current_templates_strokes, current_offset + glyph_origins
+    return current_templates_strokes, current_offset
+
+
+# `run_generator`, but closes the generator and returns None once `stop` is set
+def run_generator_until[T](
+    gen: typing.Generator[typing.Any, typing.Any, T], stop: threading.Event
+) -> T | None:
+    try:
+        while True:
+            if stop.is_set():
+                gen.close()
+                return None
+            next(gen)
+    except StopIteration as e:
+        return e.value
+
+
+def run_generator[T](gen: typing.Generator[typing.Any, typing.Any, T]) -> T:
+    while True:
+        try:
+            next(gen)
+        except StopIteration as e:
+            return e.value
 
 
 def mk_circle(diameter: int) -> NDArray_u8:
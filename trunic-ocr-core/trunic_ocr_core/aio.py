@@ -0,0 +1,129 @@
+# asyncio facade: each step of the blocking generators runs in an executor, and the
+# steps are yielded from an async iterator. a cancelled task can't interrupt the
+# step in progress, but the generator is closed as soon as that step is over, which
+# frees its intermediates, and no further steps run
+
+import asyncio
+import concurrent.futures
+import typing
+
+from . import (
+    GlyphGeometry,
+    GlyphTemplates,
+    NDArray_f32,
+    NDArray_i32,
+    RecognizedGlyphPod,
+)
+from . import findGlyphs as find_glyphs_sync
+from . import fitGlyphs as fit_glyphs_sync
+
+
+class AsyncStages[Y, R]:
+    def __init__(
+        self,
+        gen: typing.Generator[Y, typing.Any, R],
+        executor: concurrent.futures.Executor | None = None,
+    ):
+        self._gen: typing.Generator[Y, typing.Any, R] | None = gen
+        self._executor = executor
+        self._step: asyncio.Future | None = None
+        self._finished = False
+        # the generator's return value, once iteration is over
+        self.value: R | None = None
+
+    @property
+    def closed(self) -> bool:
+        return self._gen is None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Y:
+        if self._gen is None:
+            raise StopAsyncIteration
+        loop = asyncio.get_running_loop()
+        self._step = step = loop.run_in_executor(self._executor, _next, self._gen)
+        try:
+            done, item = await asyncio.shield(step)
+        except asyncio.CancelledError:
+            self.close()
+            raise
+        except BaseException:
+            self._gen = None
+            raise
+        finally:
+            if step.done():
+                self._step = None
+        if done:
+            self._gen = None
+            self._finished = True
+            self.value = item
+            raise StopAsyncIteration
+        return item
+
+    # closes the generator now, or right after the step in progress
+    def close(self):
+        if self._gen is None:
+            return
+        if self._step is not None and not self._step.done():
+            self._step.add_done_callback(lambda _f: self._close_now())
+        else:
+            self._close_now()
+
+    def _close_now(self):
+        gen, self._gen = self._gen, None
+        self._step = None
+        if gen is not None:
+            gen.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    # runs to the end, discarding progress, and returns the generator's value
+    async def result(self) -> R:
+        async for _ in self:
+            pass
+        if not self._finished:
+            raise RuntimeError("closed before finishing")
+        return self.value
+
+
+# `StopIteration` can't be raised through a future
+def _next[Y](gen: typing.Generator[Y, typing.Any, typing.Any]) -> tuple[bool, Y]:
+    try:
+        return False, next(gen)
+    except StopIteration as e:
+        return True, e.value
+
+
+def findGlyphs(
+    src_raw,
+    *,
+    executor: concurrent.futures.Executor | None = None,
+    **kwargs,
+) -> AsyncStages:
+    return AsyncStages(find_glyphs_sync(src_raw, **kwargs), executor)
+
+
+def fitGlyphs(
+    strokes_bordered: NDArray_f32,
+    glyph_geometry: GlyphGeometry,
+    glyph_templates: GlyphTemplates,
+    glyph_origins_raw: NDArray_i32 | list[int],
+    *,
+    executor: concurrent.futures.Executor | None = None,
+    **kwargs,
+) -> AsyncStages[RecognizedGlyphPod, None]:
+    return AsyncStages(
+        fit_glyphs_sync(
+            strokes_bordered,
+            glyph_geometry,
+            glyph_templates,
+            glyph_origins_raw,
+            **kwargs,
+        ),
+        executor,
+    )
@@ -0,0 +1,185 @@
+# finds the fastest way to fit glyphs on this host. every engine in `FIT_ENGINES` is
+# timed with each worker count on representative pages, and
+# the fastest configuration that gives exactly the glyphs "float" does on all of
+# them is saved to `fit_tuning_path()` for each template size bucket, under
+# `fit_tuning_host()`. `fitGlyphs` then uses it with `engine="auto"`
+#
+#   python -m trunic_ocr_core.autotune                    # synthetic pages
+#   python -m trunic_ocr_core.autotune page1.png page2.png
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+from . import (
+    FIT_ENGINES,
+    GlyphGeometry,
+    GlyphTemplates,
+    NDArray_f32,
+    NDArray_i32,
+    decodeImageGray,
+    findGlyphs,
+    fitGlyphs,
+    fit_tuning_host,
+    fit_tuning_path,
+    load_fit_tuning,
+    run_generator,
+    template_size_bucket,
+)
+from . import synth
+
+type FoundGlyphs = tuple[NDArray_f32, dict, GlyphGeometry, GlyphTemplates, NDArray_i32]
+
+# `size` in `synth.DEFAULT_GEOMETRY_PRIM` units, spanning buckets 13 to 16
+SYNTH_SIZES = (22, 32, 44, 64, 88)
+
+
+def candidates(
+    engines: typing.Sequence[str] = FIT_ENGINES, cpus: int | None = None
+) -> list[dict[str, typing.Any]]:
+    cpus = cpus or os.cpu_count() or 1
+    worker_counts = [None, *(n for n in (2, 4, 8, 16, 32) if n <= cpus)]
+    return [dict(engine=engine, workers=n) for engine in engines for n in worker_counts]
+
+
+def synth_pages(n_glyphs=120, sizes=SYNTH_SIZES) -> typing.Iterator[FoundGlyphs]:
+    for size in sizes:
+        page = synth.random_page(
+            n_glyphs,
+            dict(size=size, stroke_width=round(8 * size / 44)),
+            seed=size,
+        )
+        yield run_generator(findGlyphs(page.image))
+
+
+def image_pages(paths: typing.Iterable[str | Path]) -> typing.Iterator[FoundGlyphs]:
+    for path in paths:
+        img, _reduction = decodeImageGray(path)
+        try:
+            yield run_generator(findGlyphs(img))
+        except Exception:
+            yield run_generator(findGlyphs(img, lax=True))
+
+
+# {bucket: the fastest exact config, with its time per glyph}, for the buckets
+# `pages` fall in
+def autotune(
+    pages: typing.Iterable[FoundGlyphs],
+    configs: list[dict[str, typing.Any]],
+    repeat=3,
+    log: typing.TextIO | None = None,
+) -> dict[int, dict[str, typing.Any]]:
+    by_bucket: dict[int, list[FoundGlyphs]] = dict()
+    for page in pages:
+        by_bucket.setdefault(
+            template_size_bucket(page[2].glyph_template_shape), []
+        ).append(page)
+
+    tuned = dict()
+    for bucket, bucket_pages in sorted(by_bucket.items()):
+        n_glyphs = sum(len(page[4]) for page in bucket_pages)
+        references = [
+            list(fitGlyphs(sb, geometry, templates, origins, engine="float"))
+            for sb, _prim, geometry, templates, origins in bucket_pages
+        ]
+        best = None
+        for config in configs:
+            # untimed, so first-call costs don't count
+            exact = all(
+                list(fitGlyphs(sb, geometry, templates, origins, **config)) == reference
+                for (sb, _prim, geometry, templates, origins), reference in zip(
+                    bucket_pages, references
+                )
+            )
+            if not exact:
+                if log is not None:
+                    print(
+                        f"bucket {bucket:2}  {json.dumps(config):44}"
+                        "  differs from float; excluded",
+                        file=log,
+                    )
+                continue
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for sb, _prim, geometry, templates, origins in bucket_pages:
+                    list(fitGlyphs(sb, geometry, templates, origins, **config))
+                samples.append(time.perf_counter() - start)
+            per_glyph = statistics.median(samples) / max(n_glyphs, 1)
+            if log is not None:
+                print(
+                    f"bucket {bucket:2}  {json.dumps(config):44}"
+                    f"  {per_glyph * 1e3:8.3f}ms/glyph",
+                    file=log,
+                )
+            if best is None or per_glyph < best["seconds_per_glyph"]:
+                best = dict(config, seconds_per_glyph=per_glyph)
+        if best is not None:
+            tuned[bucket] = dict(best, glyphs=n_glyphs)
+    return tuned
+
+
+# merges `tuned` into the tuning file for `host`, replacing the buckets it has
+def save_fit_tuning(
+    tuned: dict[int, dict[str, typing.Any]],
+    path: str | None = None,
+    host: str | None = None,
+):
+    path = path or fit_tuning_path()
+    host = host or fit_tuning_host()
+    tuning = dict(load_fit_tuning(path))
+    tuning[host] = dict(
+        tuning.get(host, dict()), **{str(b): c for b, c in tuned.items()}
+    )
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=Path(path).parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(tuning, f, indent=1)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    load_fit_tuning.cache_clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="time the ways to fit glyphs and save the fastest for this host"
+    )
+    parser.add_argument(
+        "images", nargs="*", help="representative pages; synthetic ones if none"
+    )
+    parser.add_argument("-n", "--repeat", type=int, default=3)
+    parser.add_argument(
+        "--synth-glyphs", type=int, default=120, help="glyphs per synthetic page"
+    )
+    parser.add_argument(
+        "--engines",
+        default=",".join(FIT_ENGINES),
+        help="comma separated engines to try",
+    )
+    parser.add_argument("-o", "--output", help=f"default: {fit_tuning_path()}")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the results without saving"
+    )
+    args = parser.parse_args()
+
+    engines = args.engines.split(",")
+    if unknown := set(engines) - set(FIT_ENGINES):
+        parser.error(f"unknown engines: {', '.join(sorted(unknown))}")
+    pages = image_pages(args.images) if args.images else synth_pages(args.synth_glyphs)
+    tuned = autotune(pages, candidates(engines), args.repeat, log=sys.stderr)
+    print(json.dumps({fit_tuning_host(): tuned}, indent=1))
+    if not args.dry_run:
+        save_fit_tuning(tuned, args.output)
+
+
+if __name__ == "__main__":
+    main()
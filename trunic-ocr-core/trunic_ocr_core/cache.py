@@ -0,0 +1,173 @@
+# on-disk cache of recognition results, keyed by a hash of the decoded image and the
+# pipeline parameters. entries are written atomically (temp file + rename), so any
+# number of processes can share a directory; the least recently used entries are
+# evicted once it grows past `max_bytes`, along with temp files of dead writers
+
+import hashlib
+import importlib.metadata
+import json
+import os
+import tempfile
+import threading
+import time
+import typing
+from pathlib import Path
+
+import numpy as np
+
+from . import (
+    GlyphGeometry,
+    NDArray_u8,
+    RecognitionResultPod,
+    RecognizedGlyphPod,
+    recognize,
+)
+
+# bump whenever the pipeline's output changes for the same input
+CACHE_FORMAT_VERSION = 1
+
+# a temp file this old isn't being written anymore
+STALE_TMP_SECONDS = 3600
+
+try:
+    _PACKAGE_VERSION = importlib.metadata.version("trunic-ocr-core")
+except importlib.metadata.PackageNotFoundError:
+    _PACKAGE_VERSION = "unknown"
+
+
+class ResultCache:
+    def __init__(self, directory: str | Path, max_bytes: int = 256 * 2**20):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._approx_bytes = sum(p.stat().st_size for p in self._entries())
+
+    def key(self, src_raw: NDArray_u8, **params) -> str:
+        h = hashlib.sha256()
+        h.update(
+            json.dumps(
+                dict(
+                    shape=src_raw.shape,
+                    dtype=src_raw.dtype.str,
+                    params=params,
+                    version=[CACHE_FORMAT_VERSION, _PACKAGE_VERSION],
+                ),
+                sort_keys=True,
+            ).encode()
+        )
+        h.update(np.ascontiguousarray(src_raw).data)
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory.joinpath(key[:2], key + ".json")
+
+    def _entries(self) -> typing.Iterator[Path]:
+        return self.directory.glob("??/*.json")
+
+    def get(self, key: str) -> dict[str, typing.Any] | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # mtime is the recency for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return json.loads(data)
+
+    def put(self, key: str, value: dict[str, typing.Any]):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        data = json.dumps(value).encode()
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        with self._lock:
+            self._approx_bytes += len(data) - replaced
+            over = self._approx_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        # left by writers that died between creating and renaming them
+        stale = time.time() - STALE_TMP_SECONDS
+        for p in self.directory.glob("??/*.tmp"):
+            try:
+                if p.stat().st_mtime < stale:
+                    p.unlink()
+            except FileNotFoundError:
+                pass
+        entries = []
+        for p in self._entries():
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                # evicted by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _m, size, _p in entries)
+        for _mtime, size, p in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self._approx_bytes = total
+
+    # `recognize`, through the cache
+    def recognize(
+        self,
+        src_raw: NDArray_u8,
+        *,
+        lax: bool | None = None,
+        slop: int = 2,
+        workers: int | None = None,
+    ) -> RecognitionResultPod:
+        key = self.key(src_raw, lax=lax, slop=slop)
+        if (cached := self.get(key)) is not None:
+            return RecognitionResultPod(
+                geometry_prim=cached["geometry_prim"],
+                geometry=GlyphGeometry.from_pod(cached["geometry"]).to_pod(),
+                glyphs=[
+                    RecognizedGlyphPod(
+                        origin=tuple(g["origin"]), strokes=tuple(g["strokes"])
+                    )
+                    for g in cached["glyphs"]
+                ],
+                lax=cached["lax"],
+                degradations=[],
+            )
+
+        result = recognize(src_raw, lax=lax, slop=slop, workers=workers)
+        result["geometry_prim"] = {
+            k: v if isinstance(v, int) else float(v)
+            for k, v in result["geometry_prim"].items()
+        }
+        self.put(
+            key,
+            dict(
+                geometry_prim=result["geometry_prim"],
+                geometry=result["geometry"],
+                glyphs=result["glyphs"],
+                lax=result["lax"],
+            ),
+        )
+        return result
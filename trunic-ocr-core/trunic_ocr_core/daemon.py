@@ -0,0 +1,254 @@
+# long-running OCR worker for batch jobs, so they don't each pay for the interpreter,
+# the imports, template construction and the first calls' allocations (and JIT
+# compilation, with `jit_kernels`). it speaks JSON Lines over stdin/stdout, or over a
+# Unix socket to any number of clients: one request object per line, one response
+# object per line, matched up by `id` since they may come back out of order
+#
+#   {"id": 1, "op": "recognize", "path": "page.png"}
+#   {"id": 2, "op": "recognize", "data": "<base64 image file>"}
+#   {"id": 3, "op": "health"}
+#   {"id": 4, "op": "stats"}
+#
+# a response has `result` on success, or `error` otherwise. recognition goes through
+# an `OcrService`, so concurrent requests are fitted in parallel like the HTTP server
+#
+#   python -m trunic_ocr_core.daemon --warm-image page.png --warm-file warm.json
+
+import argparse
+import base64
+import binascii
+import collections
+import concurrent.futures
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import typing
+from pathlib import Path
+
+from . import GlyphGeometry, decodeImageGray, jit_kernels
+from .server import OcrService
+
+
+class OcrDaemon:
+    def __init__(self, service: OcrService, *, workers: int | None = None):
+        self.service = service
+        self.started = time.monotonic()
+        self.warmup_seconds = 0.0
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            workers or os.cpu_count() or 1
+        )
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._in_flight = 0
+
+    def close(self):
+        self._executor.shutdown()
+
+    # `geometries` get their templates built; each of `images` is recognized once,
+    # which also runs everything that is slow only the first time
+    def warm_up(
+        self,
+        geometries: typing.Iterable[GlyphGeometry] = (),
+        images: typing.Iterable[str | Path] = (),
+    ):
+        start = time.perf_counter()
+        jit_kernels()
+        self.service.prewarm(geometries)
+        for path in images:
+            img, _reduction = decodeImageGray(path)
+            self.service.recognize(img)
+        self.warmup_seconds = time.perf_counter() - start
+
+    def handle(self, request) -> dict[str, typing.Any]:
+        if not isinstance(request, dict):
+            return dict(error="request must be an object")
+        response = dict(id=request.get("id"))
+        op = request.get("op")
+        if op == "health":
+            response["result"] = self.health()
+        elif op == "stats":
+            response["result"] = self.stats()
+        elif op == "recognize":
+            try:
+                if "path" in request:
+                    src = request["path"]
+                else:
+                    src = base64.b64decode(request["data"], validate=True)
+                img, _reduction = decodeImageGray(src)
+            except (KeyError, TypeError, ValueError, binascii.Error, OSError):
+                response["error"] = "could not decode image"
+                return response
+            try:
+                response["result"] = self.service.recognize(img)
+            except Exception as e:
+                response["error"] = type(e).__name__
+        else:
+            response["error"] = f"unknown op: {op!r}"
+        return response
+
+    def health(self) -> dict[str, typing.Any]:
+        with self._lock:
+            in_flight = self._in_flight
+        return dict(
+            ok=True,
+            uptime=time.monotonic() - self.started,
+            warmup_seconds=self.warmup_seconds,
+            in_flight=in_flight,
+        )
+
+    def stats(self) -> dict[str, typing.Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        return dict(self.service.metrics(), daemon=counters)
+
+    # serves one stream until EOF, handling its requests concurrently, and returns
+    # once every response has been written
+    def serve_lines(self, rfile: typing.BinaryIO, wfile: typing.BinaryIO):
+        write_lock = threading.Lock()
+        pending: set[concurrent.futures.Future] = set()
+
+        def respond(response):
+            data = json.dumps(response).encode() + b"\n"
+            with write_lock:
+                wfile.write(data)
+                wfile.flush()
+
+        def run(request):
+            try:
+                response = self.handle(request)
+            except Exception as e:
+                # still matched up to the request, when it has an id
+                response = dict(
+                    id=request.get("id") if isinstance(request, dict) else None,
+                    error=type(e).__name__,
+                )
+            with self._lock:
+                self._in_flight -= 1
+                self._counters["errors" if "error" in response else "ok"] += 1
+            respond(response)
+
+        for line in rfile:
+            if not line.strip():
+                continue
+            with self._lock:
+                self._counters["requests"] += 1
+            try:
+                request = json.loads(line)
+            except ValueError:
+                with self._lock:
+                    self._counters["errors"] += 1
+                respond(dict(error="invalid JSON"))
+                continue
+            with self._lock:
+                self._in_flight += 1
+            pending.add(self._executor.submit(run, request))
+            pending = {f for f in pending if not f.done()}
+        concurrent.futures.wait(pending)
+
+
+class ThreadingUnixLineServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+def make_unix_server(daemon: OcrDaemon, path: str) -> socketserver.BaseServer:
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            daemon.serve_lines(self.rfile, self.wfile)
+
+    return ThreadingUnixLineServer(path, Handler)
+
+
+# the geometries saved by `save_warm_file`, most recently used last
+def load_warm_file(path: str | Path) -> list[GlyphGeometry]:
+    try:
+        pods = json.loads(Path(path).read_bytes())
+    except FileNotFoundError:
+        return []
+    return [GlyphGeometry.from_pod(pod) for pod in pods]
+
+
+def save_warm_file(path: str | Path, geometries: list[GlyphGeometry]):
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump([geometry.to_pod() for geometry in geometries], f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="serve OCR over JSON Lines, on stdin/stdout or a Unix socket"
+    )
+    parser.add_argument("--unix", help="listen on a Unix socket instead")
+    parser.add_argument(
+        "--warm-image",
+        action="append",
+        default=[],
+        help="recognize this image at startup; may be repeated",
+    )
+    parser.add_argument(
+        "--warm-file",
+        help="build templates for the geometries saved here at startup, and save"
+        " the cached ones on exit",
+    )
+    parser.add_argument("--workers", type=int)
+    parser.add_argument(
+        "--batch-fit",
+        action="store_true",
+        help="coalesce requests whose geometries share a key; see --geometry-quantum",
+    )
+    parser.add_argument("--batch-window", type=float, default=0.01)
+    parser.add_argument("--geometry-quantum", type=float, default=0.0)
+    parser.add_argument("--template-cache-size", type=int, default=32)
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="solve the geometry strict and lax concurrently",
+    )
+    args = parser.parse_args()
+
+    service = OcrService(
+        batch_fit=args.batch_fit,
+        batch_window=args.batch_window,
+        geometry_quantum=args.geometry_quantum,
+        detect_workers=args.workers,
+        fit_workers=args.workers,
+        template_cache_size=args.template_cache_size,
+        speculative=args.speculative,
+    )
+    daemon = OcrDaemon(service, workers=args.workers)
+    try:
+        daemon.warm_up(
+            load_warm_file(args.warm_file) if args.warm_file else (),
+            args.warm_image,
+        )
+        if args.unix is not None:
+            server = make_unix_server(daemon, args.unix)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                os.unlink(args.unix)
+        else:
+            daemon.serve_lines(sys.stdin.buffer, sys.stdout.buffer)
+    finally:
+        daemon.close()
+        if args.warm_file:
+            save_warm_file(args.warm_file, service.templates.geometries())
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
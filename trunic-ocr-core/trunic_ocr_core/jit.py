@@ -0,0 +1,230 @@
+# compiled versions of the per-component and per-glyph Python loops, used through
+# `jit_kernels` when Numba is installed. each one gives the same output as the NumPy
+# code it replaces; float sums are accumulated in the same order where that matters.
+# compiled code is cached on disk (`NUMBA_CACHE_DIR`, by default next to this file),
+# so only the first run after an install or upgrade pays for compilation
+
+import numba
+import numpy as np
+
+
+# which components `clean_strokes` removes, by label
+@numba.njit(cache=True, nogil=True)
+def clean_strokes_removed(
+    cc_labels,
+    cc_stats,
+    medial_axis,
+    stroke_width,
+    area_ratio_min,
+    stroke_filt_tol,
+    stroke_filt_thresh_pct,
+):
+    n_comp = cc_stats.shape[0]
+    lo = np.float32((stroke_width - stroke_filt_tol) / 2)
+    hi = np.float32((stroke_width + stroke_filt_tol) / 2)
+    total = np.zeros(n_comp, dtype=np.int64)
+    in_range = np.zeros(n_comp, dtype=np.int64)
+    for y in range(cc_labels.shape[0]):
+        for x in range(cc_labels.shape[1]):
+            i = cc_labels[y, x]
+            v = medial_axis[y, x]
+            if i == 0 or v == 0:
+                continue
+            total[i] += 1
+            if lo <= v <= hi:
+                in_range[i] += 1
+
+    removed = np.zeros(n_comp, dtype=np.bool_)
+    for i in range(1, n_comp):
+        if cc_stats[i, 4] < stroke_width * stroke_width * area_ratio_min:
+            removed[i] = True
+            continue
+        count = in_range[i]
+        # the rest of the bounding box is zeroed out there, and may count as in range
+        if lo <= 0 <= hi:
+            count += cc_stats[i, 2] * cc_stats[i, 3] - total[i]
+        if total[i] > 0 and count / total[i] < stroke_filt_thresh_pct / 100:
+            removed[i] = True
+    return removed
+
+
+@numba.njit(cache=True, nogil=True)
+def zero_labels(img, cc_labels, removed):
+    for y in range(img.shape[0]):
+        for x in range(img.shape[1]):
+            if removed[cc_labels[y, x]]:
+                img[y, x] = 0
+
+
+# the row of each component in `find_baselines`, relative to its bounding box
+@numba.njit(cache=True, nogil=True)
+def baseline_rows(cc_labels, cc_stats, lower_edge, both_edge):
+    n_cc = cc_stats.shape[0]
+    starts = np.zeros(n_cc + 1, dtype=np.int64)
+    for i in range(n_cc):
+        starts[i + 1] = starts[i] + (cc_stats[i, 3] if i > 0 else 0)
+    summed = np.zeros(starts[-1], dtype=np.int64)
+    for y in range(cc_labels.shape[0]):
+        for x in range(cc_labels.shape[1]):
+            i = cc_labels[y, x]
+            if i == 0:
+                continue
+            summed[starts[i] + y - cc_stats[i, 1]] += (lower_edge[y, x] & 1) + 3 * (
+                both_edge[y, x] & 1
+            )
+    rows = np.zeros(n_cc, dtype=np.int64)
+    for i in range(1, n_cc):
+        rows[i] = np.argmax(summed[starts[i] : starts[i + 1]])
+    return rows
+
+
+# the column of each component in `find_vertical_segments_gen`, relative to its
+# bounding box. columns are summed top to bottom in float32, like `np.sum(axis=0)`
+@numba.njit(cache=True, nogil=True)
+def segment_columns(cc_labels, cc_stats, fill, edge, edge_weight):
+    n_cc = cc_stats.shape[0]
+    starts = np.zeros(n_cc + 1, dtype=np.int64)
+    for i in range(n_cc):
+        starts[i + 1] = starts[i] + (cc_stats[i, 2] if i > 0 else 0)
+    summed_f = np.zeros(starts[-1], dtype=np.float32)
+    summed_e = np.zeros(starts[-1], dtype=np.float32)
+    for y in range(cc_labels.shape[0]):
+        for x in range(cc_labels.shape[1]):
+            i = cc_labels[y, x]
+            if i == 0:
+                continue
+            j = starts[i] + x - cc_stats[i, 0]
+            summed_f[j] += fill[y, x]
+            summed_e[j] += edge[y, x]
+    w = np.float32(edge_weight)
+    cols = np.zeros(n_cc, dtype=np.int64)
+    for i in range(1, n_cc):
+        s = starts[i]
+        best = s
+        best_v = summed_f[s] + w * summed_e[s]
+        for j in range(s + 1, starts[i + 1]):
+            v = summed_f[j] + w * summed_e[j]
+            if v > best_v:
+                best = j
+                best_v = v
+        cols[i] = best - s
+    return cols
+
+
+# `find_approx_glyph_height`'s furthest stroke from the baselines in each Voronoi
+# cell, spread over the cell, for the cells `sample_stride` selects
+@numba.njit(cache=True, nogil=True)
+def voronoi_max(labels, dist_baseline, strokes_notbl, sample_stride):
+    lo = labels.min()
+    hi = labels.max()
+    cell_max = np.zeros(hi - lo + 1, dtype=np.float64)
+    for y in range(labels.shape[0]):
+        for x in range(labels.shape[1]):
+            if strokes_notbl[y, x] != 0:
+                i = labels[y, x] - lo
+                cell_max[i] = max(cell_max[i], dist_baseline[y, x])
+    out = np.zeros(labels.shape, dtype=np.float64)
+    sampled = np.zeros(labels.shape, dtype=np.bool_)
+    for y in range(labels.shape[0]):
+        for x in range(labels.shape[1]):
+            i = labels[y, x] - lo
+            if i % sample_stride == 0:
+                out[y, x] = cell_max[i]
+                sampled[y, x] = True
+    return out, sampled
+
+
+# `fit_glyph_greedy`; returns the strokes, the index of the offset, and the stats.
+# adding a stroke only changes the template where that stroke is drawn, so the
+# per-offset scores are updated from those pixels instead of recomputed. sums are
+# of `zero`'s type: float64 for float32 windows and templates, which comes out
+# marginally more precise than NumPy's float32 sums (that only shows in the
+# diagnostics), or int64 for quantized ones, which is exact
+@numba.njit(cache=True, nogil=True)
+def fit_greedy(windows, glyph_template, glyph_template_mask, glyph_template_base, zero):
+    n_offsets = windows.shape[0]
+    n_strokes = glyph_template.shape[0]
+    n_px = glyph_template_base.size
+    win = windows.reshape(n_offsets, n_px)
+    tmpl = glyph_template.reshape(n_strokes, n_px)
+    mask = glyph_template_mask.reshape(n_strokes, n_px)
+    cur = glyph_template_base.copy().reshape(n_px)
+
+    # scores against the template with and without negatives, by offset, and the norm
+    scores_pos = np.full(n_offsets, zero)
+    scores = np.full(n_offsets, zero)
+    norm = zero
+    for p in range(n_px):
+        norm += max(cur[p], 0)
+    for o in range(n_offsets):
+        for p in range(n_px):
+            v = win[o, p]
+            if v != 0:
+                scores_pos[o] += v * max(cur[p], 0)
+                scores[o] += v * cur[p]
+    cur_offset = np.argmax(scores_pos)
+    cur_fit = scores[cur_offset] / norm
+
+    cur_strokes = np.zeros(n_strokes, dtype=np.bool_)
+    runner_up = -np.inf
+    iterations = 0
+    changed = np.empty(n_px, dtype=np.int64)
+    d_scores_pos = np.full(n_offsets, zero)
+    d_scores = np.full(n_offsets, zero)
+    for _i in range(n_strokes):
+        iterations += 1
+        best_s = -1
+        best_fit = 0.0
+        best_offset = 0
+        # the largest fit other than the best
+        others = -np.inf
+        for s in range(n_strokes):
+            if cur_strokes[s]:
+                continue
+            n_changed = 0
+            d_norm = zero
+            for p in range(n_px):
+                if mask[s, p] and tmpl[s, p] > cur[p]:
+                    changed[n_changed] = p
+                    n_changed += 1
+                    d_norm += max(tmpl[s, p], 0) - max(cur[p], 0)
+            for o in range(n_offsets):
+                dp = zero
+                d = zero
+                for k in range(n_changed):
+                    p = changed[k]
+                    v = win[o, p]
+                    if v != 0:
+                        dp += v * (max(tmpl[s, p], 0) - max(cur[p], 0))
+                        d += v * (tmpl[s, p] - cur[p])
+                d_scores_pos[o] = dp
+                d_scores[o] = d
+            offset = np.argmax(scores_pos + d_scores_pos)
+            fit = (scores[offset] + d_scores[offset]) / (norm + d_norm)
+            if best_s < 0 or fit > best_fit:
+                if best_s >= 0:
+                    others = max(others, best_fit)
+                best_s = s
+                best_fit = fit
+                best_offset = offset
+            else:
+                others = max(others, fit)
+        if best_fit < cur_fit:
+            runner_up = max(runner_up, best_fit)
+            break
+        runner_up = max(others, cur_fit)
+
+        s = best_s
+        for p in range(n_px):
+            if mask[s, p] and tmpl[s, p] > cur[p]:
+                norm += max(tmpl[s, p], 0) - max(cur[p], 0)
+                for o in range(n_offsets):
+                    v = win[o, p]
+                    if v != 0:
+                        scores_pos[o] += v * (max(tmpl[s, p], 0) - max(cur[p], 0))
+                        scores[o] += v * (tmpl[s, p] - cur[p])
+                cur[p] = tmpl[s, p]
+        cur_strokes[s] = True
+        cur_fit = best_fit
+        cur_offset = best_offset
+    return cur_strokes, cur_offset, cur_fit, runner_up, iterations
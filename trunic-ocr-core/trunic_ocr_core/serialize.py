@@ -0,0 +1,188 @@
+# versioned binary container for the result of `findGlyphs`, so detection and
+# fitting can run in separate processes
+#
+# layout: magic, u32 version, u32 header length, a JSON header (geometry, prim and
+# an array table), then each array at a 64-byte aligned offset. arrays are read back
+# as views into the buffer, so loading from `mmap` or `shared_memory` copies nothing
+# (except strokes stored as bits, which have to be unpacked)
+
+import json
+import mmap
+import typing
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+from . import GlyphGeometry, GlyphTemplates
+
+MAGIC = b"TRUNICDT"
+VERSION = 1
+ALIGN = 64
+_PREFIX = np.dtype([("magic", "S8"), ("version", "<u4"), ("header_len", "<u4")])
+
+type DetectionResult = tuple[
+    np.ndarray, dict, GlyphGeometry, GlyphTemplates, np.ndarray
+]
+type StrokesEncoding = typing.Literal["bits", "uint8", "float32"]
+
+
+class DetectionFormatError(Exception):
+    pass
+
+
+def _align(n: int) -> int:
+    return -(-n // ALIGN) * ALIGN
+
+
+def _layout(
+    found: DetectionResult, strokes: StrokesEncoding
+) -> tuple[bytes, list[tuple[int, np.ndarray]], int]:
+    strokes_bordered, geometry_prim, geometry, templates, origins = found
+    if strokes == "bits":
+        strokes_data = np.packbits(strokes_bordered != 0, axis=None)
+    elif strokes in ("uint8", "float32"):
+        strokes_data = np.ascontiguousarray(strokes_bordered, dtype=strokes)
+    else:
+        raise ValueError(f"unknown strokes encoding {strokes!r}")
+    arrays = dict(
+        strokes=strokes_data,
+        templates_glyphs=np.ascontiguousarray(templates.glyphs, dtype="<f4"),
+        templates_mask=np.ascontiguousarray(templates.mask, dtype=np.bool_),
+        templates_base=np.ascontiguousarray(templates.base, dtype="<f4"),
+        origins=np.ascontiguousarray(origins, dtype="<i4").reshape(-1, 2),
+    )
+
+    # the header's size depends on the offsets, which depend on the header's size
+    header_len = 0
+    while True:
+        offset = _align(_PREFIX.itemsize + header_len)
+        table = dict()
+        placed = []
+        for name, arr in arrays.items():
+            table[name] = dict(offset=offset, dtype=arr.dtype.str, shape=arr.shape)
+            placed.append((offset, arr))
+            offset = _align(offset + arr.nbytes)
+        header = json.dumps(
+            dict(
+                geometry=geometry.to_pod(),
+                geometry_prim={k: float(v) for k, v in geometry_prim.items()},
+                strokes=dict(
+                    encoding=strokes,
+                    shape=strokes_bordered.shape,
+                ),
+                arrays=table,
+            )
+        ).encode()
+        if len(header) <= header_len:
+            header = header.ljust(header_len)
+            return header, placed, offset
+        header_len = len(header)
+
+
+def detection_nbytes(found: DetectionResult, *, strokes: StrokesEncoding = "uint8"):
+    return _layout(found, strokes)[2]
+
+
+def pack_detection_into(
+    buf, found: DetectionResult, *, strokes: StrokesEncoding = "uint8"
+) -> int:
+    header, placed, total = _layout(found, strokes)
+    out = np.frombuffer(buf, dtype=np.uint8)
+    if len(out) < total:
+        raise ValueError(f"buffer too small: {len(out)} < {total} bytes")
+    prefix = np.array([(MAGIC, VERSION, len(header))], dtype=_PREFIX)
+    out[: _PREFIX.itemsize] = prefix.view(np.uint8)
+    out[_PREFIX.itemsize : _PREFIX.itemsize + len(header)] = np.frombuffer(
+        header, dtype=np.uint8
+    )
+    for offset, arr in placed:
+        out[offset : offset + arr.nbytes] = arr.reshape(-1).view(np.uint8)
+    return total
+
+
+def pack_detection(
+    found: DetectionResult, *, strokes: StrokesEncoding = "uint8"
+) -> bytearray:
+    buf = bytearray(detection_nbytes(found, strokes=strokes))
+    pack_detection_into(buf, found, strokes=strokes)
+    return buf
+
+
+# the arrays are views into `buf`, which has to outlive them
+def unpack_detection(buf) -> DetectionResult:
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if len(data) < _PREFIX.itemsize:
+        raise DetectionFormatError("truncated")
+    prefix = data[: _PREFIX.itemsize].view(_PREFIX)[0]
+    if prefix["magic"] != MAGIC:
+        raise DetectionFormatError("not a detection result")
+    if prefix["version"] != VERSION:
+        raise DetectionFormatError(f"unsupported version {prefix['version']}")
+    header_end = _PREFIX.itemsize + int(prefix["header_len"])
+    header = json.loads(bytes(data[_PREFIX.itemsize : header_end]))
+
+    def array(name):
+        spec = header["arrays"][name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        if spec["offset"] + count * dtype.itemsize > len(data):
+            raise DetectionFormatError("truncated")
+        return np.frombuffer(
+            buf, dtype=dtype, count=count, offset=spec["offset"]
+        ).reshape(spec["shape"])
+
+    strokes_shape = tuple(header["strokes"]["shape"])
+    if header["strokes"]["encoding"] == "bits":
+        strokes_bordered = np.float32(
+            np.unpackbits(array("strokes"), count=int(np.prod(strokes_shape)))
+        ).reshape(strokes_shape)
+    else:
+        strokes_bordered = array("strokes")
+
+    geometry_prim = header["geometry_prim"]
+    for k in ("upscale", "stroke_width", "angle"):
+        geometry_prim[k] = int(geometry_prim[k])
+    return (
+        strokes_bordered,
+        geometry_prim,
+        GlyphGeometry.from_pod(header["geometry"]),
+        GlyphTemplates(
+            glyphs=array("templates_glyphs"),
+            mask=array("templates_mask"),
+            base=array("templates_base"),
+        ),
+        array("origins"),
+    )
+
+
+def save_detection(
+    path: str | Path, found: DetectionResult, *, strokes: StrokesEncoding = "uint8"
+):
+    Path(path).write_bytes(pack_detection(found, strokes=strokes))
+
+
+# memory-maps the file read-only; the arrays keep the mapping open
+def load_detection(path: str | Path) -> DetectionResult:
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return unpack_detection(mm)
+
+
+# the caller owns the segment: `close()` it when done, and `unlink()` it once no
+# process needs it any more
+def detection_to_shared_memory(
+    found: DetectionResult, *, strokes: StrokesEncoding = "uint8"
+) -> shared_memory.SharedMemory:
+    shm = shared_memory.SharedMemory(
+        create=True, size=detection_nbytes(found, strokes=strokes)
+    )
+    pack_detection_into(shm.buf, found, strokes=strokes)
+    return shm
+
+
+def detection_from_shared_memory(
+    name: str,
+) -> tuple[DetectionResult, shared_memory.SharedMemory]:
+    shm = shared_memory.SharedMemory(name=name)
+    return unpack_detection(shm.buf), shm
@@ -0,0 +1,442 @@
+# local OCR service: POST an image to /recognize and get the glyphs back as JSON
+#
+# detection runs on the request threads, and each request's glyphs are fitted on a
+# pool of fit workers with cached templates. with `batch_fit`, requests go through a
+# batcher thread first, which coalesces those whose geometries share a cache key
+# within `batch_window` (identical pages, or similar ones with `geometry_quantum`)
+# and fits all of their glyphs together with `fit_windows_batch`; a request with
+# nothing to coalesce with is fitted on its own as usual
+#
+#   python -m trunic_ocr_core.server --port 8000
+#   curl --data-binary @page.png localhost:8000/recognize
+
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import json
+import os
+import queue
+import socketserver
+import statistics
+import threading
+import time
+import typing
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from . import (
+    GlyphGeometry,
+    GlyphTemplates,
+    NDArray_f32,
+    NDArray_i32,
+    RecognizedGlyphPod,
+    decodeImageGray,
+    extract_glyph_windows,
+    findGlyphs,
+    find_glyphs_speculative,
+    fitGlyphs,
+    fit_windows_batch,
+    TemplateCache,
+    make_glyph_geometry_from_prim,
+    run_generator,
+)
+
+LATENCY_SAMPLES = 1000
+
+
+# with `quantum`, geometries whose prims round to the same values share a key, and
+# are fitted with the geometry rebuilt from the rounded prim; that is an
+# approximation, to be checked with `benchmarks/accuracy.py`
+def geometry_cache_key(geometry_prim: dict, quantum=0.0) -> tuple:
+    def q(v):
+        return float(v) if quantum <= 0 else round(float(v) / quantum) * quantum
+
+    return (
+        int(geometry_prim["upscale"]),
+        int(geometry_prim["stroke_width"]),
+        int(geometry_prim["angle"]),
+        *(q(geometry_prim[k]) for k in ("size", "upper", "lower", "h_nudge")),
+    )
+
+
+@dataclass
+class FitJob:
+    key: tuple
+    strokes_bordered: NDArray_f32
+    geometry: GlyphGeometry
+    glyph_origins_raw: NDArray_i32
+    future: concurrent.futures.Future
+    enqueued: float = field(default_factory=time.perf_counter)
+
+
+class OcrService:
+    def __init__(
+        self,
+        *,
+        batch_window=0.01,
+        max_batch_requests=16,
+        max_batch_glyphs=64,
+        batch_fit=False,
+        geometry_quantum=0.0,
+        detect_workers: int | None = None,
+        fit_workers: int | None = None,
+        template_cache_size=32,
+        speculative=False,
+    ):
+        self.batch_window = batch_window
+        self.max_batch_requests = max_batch_requests
+        self.max_batch_glyphs = max_batch_glyphs
+        self.batch_fit = batch_fit
+        self.geometry_quantum = geometry_quantum
+        self.speculative = speculative
+        self._detect_slots = threading.BoundedSemaphore(
+            detect_workers or os.cpu_count() or 1
+        )
+        self._jobs: queue.Queue[FitJob | None] = queue.Queue()
+        self._fit_pool = concurrent.futures.ThreadPoolExecutor(
+            fit_workers or os.cpu_count() or 1
+        )
+        self.templates = TemplateCache(template_cache_size)
+        self._lock = threading.Lock()
+        self._waiting_detect = 0
+        self._counters = collections.Counter()
+        self._batch_requests: collections.deque[int] = collections.deque(
+            maxlen=LATENCY_SAMPLES
+        )
+        self._batch_glyphs: collections.deque[int] = collections.deque(
+            maxlen=LATENCY_SAMPLES
+        )
+        self._latency: dict[str, collections.deque[float]] = {
+            k: collections.deque(maxlen=LATENCY_SAMPLES)
+            for k in ("detect", "fit_wait", "fit", "total")
+        }
+        self._batcher = None
+        if batch_fit:
+            self._batcher = threading.Thread(target=self._run_batcher, daemon=True)
+            self._batcher.start()
+
+    def close(self):
+        if self._batcher is not None:
+            self._jobs.put(None)
+            self._batcher.join()
+        self._fit_pool.shutdown()
+
+    # builds the templates for `geometries` ahead of the requests that need them
+    def prewarm(self, geometries: typing.Iterable[GlyphGeometry]):
+        for geometry in geometries:
+            self.templates.get(geometry)
+
+    # strict, then lax if strict detection fails, like `recognize`; or both at once
+    # with `speculative`
+    def recognize(self, src_raw) -> dict[str, typing.Any]:
+        start = time.perf_counter()
+        with self._lock:
+            self._waiting_detect += 1
+        try:
+            with self._detect_slots:
+                with self._lock:
+                    self._waiting_detect -= 1
+                lax = False
+                if self.speculative:
+                    found, lax = run_generator(find_glyphs_speculative(src_raw))
+                else:
+                    try:
+                        found = run_generator(findGlyphs(src_raw))
+                    except Exception:
+                        lax = True
+                        found = run_generator(findGlyphs(src_raw, lax=True))
+        except BaseException:
+            with self._lock:
+                self._counters["detect_failures"] += 1
+            raise
+        detected = time.perf_counter()
+        strokes_bordered, geometry_prim, geometry, _templates, origins = found
+
+        key = geometry_cache_key(geometry_prim, self.geometry_quantum)
+        if self.geometry_quantum > 0:
+            geometry = make_glyph_geometry_from_prim(
+                dict(
+                    geometry_prim,
+                    **dict(zip(("size", "upper", "lower", "h_nudge"), key[3:])),
+                )
+            )
+        job = FitJob(
+            key, strokes_bordered, geometry, origins, concurrent.futures.Future()
+        )
+        if self._batcher is not None:
+            self._jobs.put(job)
+        else:
+            self._fit_pool.submit(self._fit_jobs, [job])
+        glyphs = job.future.result()
+
+        end = time.perf_counter()
+        with self._lock:
+            self._counters["requests"] += 1
+            self._latency["detect"].append(detected - start)
+            self._latency["total"].append(end - start)
+        return dict(
+            geometry_prim={k: float(v) for k, v in geometry_prim.items()},
+            glyphs=glyphs,
+            lax=lax,
+        )
+
+    def _run_batcher(self):
+        while True:
+            first = self._jobs.get()
+            if first is None:
+                return
+            pending = [first]
+            deadline = time.perf_counter() + self.batch_window
+            while len(pending) < self.max_batch_requests:
+                try:
+                    job = self._jobs.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._jobs.put(None)
+                    break
+                pending.append(job)
+
+            by_key: dict[tuple, list[FitJob]] = dict()
+            for job in pending:
+                by_key.setdefault(job.key, []).append(job)
+            for jobs in by_key.values():
+                self._fit_pool.submit(self._fit_jobs, jobs)
+
+    # on the fit pool; jobs share a key, and more than one are fitted together
+    def _fit_jobs(self, jobs: list[FitJob]):
+        try:
+            start = time.perf_counter()
+            geometry = jobs[0].geometry
+            templates = self.templates.get(geometry)
+            if len(jobs) > 1:
+                results = self._fit_batched(geometry, templates, jobs)
+            else:
+                (job,) = jobs
+                results = [
+                    list(
+                        fitGlyphs(
+                            job.strokes_bordered,
+                            job.geometry,
+                            templates,
+                            job.glyph_origins_raw,
+                        )
+                    )
+                ]
+            end = time.perf_counter()
+        except BaseException as e:
+            for job in jobs:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            return
+        with self._lock:
+            self._counters["batches"] += 1
+            self._batch_requests.append(len(jobs))
+            self._batch_glyphs.append(sum(len(job.glyph_origins_raw) for job in jobs))
+            for job in jobs:
+                self._latency["fit_wait"].append(start - job.enqueued)
+                self._latency["fit"].append(end - start)
+        for job, glyphs in zip(jobs, results):
+            job.future.set_result(glyphs)
+
+    def _fit_batched(
+        self, geometry: GlyphGeometry, templates: GlyphTemplates, jobs: list[FitJob]
+    ) -> list[list[RecognizedGlyphPod]]:
+        upscale = geometry.upscale
+        # the same offsets as `fitGlyphs` with the default slop
+        all_template_offsets = (
+            np.dstack(np.mgrid[: upscale * 2 + 1, : upscale * 2 + 1]).reshape(-1, 2)
+            - upscale
+        )
+        glyphs = [
+            (i, origin, job)
+            for i, job in enumerate(jobs)
+            for origin in job.glyph_origins_raw
+        ]
+        results: list[list[RecognizedGlyphPod]] = [[] for _ in jobs]
+        # bounded, since every glyph brings all of its offset windows
+        for chunk_start in range(0, len(glyphs), self.max_batch_glyphs):
+            chunk = glyphs[chunk_start : chunk_start + self.max_batch_glyphs]
+            windows = np.concatenate(
+                [
+                    extract_glyph_windows(
+                        job.geometry.stroke_width,
+                        job.strokes_bordered,
+                        geometry.glyph_template_shape,
+                        geometry.glyph_template_origin,
+                        origin[np.newaxis],
+                        all_template_offsets,
+                    )
+                    for _i, origin, job in chunk
+                ]
+            )
+            strokes, offsets = run_generator(
+                fit_windows_batch(
+                    windows,
+                    templates.glyphs,
+                    templates.mask,
+                    templates.base,
+                    all_template_offsets,
+                )
+            )
+            for (i, origin, _job), s, o in zip(chunk, strokes, offsets):
+                results[i].append(
+                    RecognizedGlyphPod(
+                        strokes=tuple(map(int, np.packbits(s, bitorder="little"))),
+                        origin=tuple(map(int, origin + o)),
+                    )
+                )
+        return results
+
+    def metrics(self) -> dict[str, typing.Any]:
+        def describe(values):
+            values = sorted(values)
+            if not values:
+                return dict(count=0)
+            return dict(
+                count=len(values),
+                mean=statistics.fmean(values),
+                p50=values[len(values) // 2],
+                p95=values[min(len(values) - 1, len(values) * 95 // 100)],
+                max=values[-1],
+            )
+
+        with self._lock:
+            return dict(
+                queue_depth=dict(detect=self._waiting_detect, fit=self._jobs.qsize()),
+                counters=dict(self._counters),
+                batch_requests=describe(self._batch_requests),
+                batch_glyphs=describe(self._batch_glyphs),
+                latency={k: describe(v) for k, v in self._latency.items()},
+                template_cache=dict(
+                    size=len(self.templates),
+                    hits=self.templates.hits,
+                    misses=self.templates.misses,
+                ),
+            )
+
+
+class OcrRequestHandler(http.server.BaseHTTPRequestHandler):
+    service: OcrService
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.send_json(200, self.service.metrics())
+        elif self.path == "/health":
+            self.send_json(200, dict(ok=True))
+        else:
+            self.send_json(404, dict(error="not found"))
+
+    def do_POST(self):
+        if self.path != "/recognize":
+            self.send_json(404, dict(error="not found"))
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.close_connection = True
+            self.send_json(411, dict(error="Content-Length required"))
+            return
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            # there's no telling where the body ends
+            self.close_connection = True
+            self.send_json(400, dict(error="invalid Content-Length"))
+            return
+        body = self.rfile.read(length)
+        try:
+            img, _reduction = decodeImageGray(body)
+        except ValueError:
+            self.send_json(400, dict(error="could not decode image"))
+            return
+        try:
+            result = self.service.recognize(img)
+        except Exception as e:
+            self.send_json(422, dict(error=type(e).__name__))
+            return
+        self.send_json(200, result)
+
+    def send_json(self, status: int, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _addr = super().get_request()
+        # `BaseHTTPRequestHandler` expects a (host, port) address
+        return request, ("local", 0)
+
+
+def make_server(
+    service: OcrService,
+    address: tuple[str, int] | None = ("127.0.0.1", 0),
+    unix_path: str | None = None,
+) -> socketserver.BaseServer:
+    handler = type("Handler", (OcrRequestHandler,), dict(service=service))
+    if unix_path is not None:
+        return ThreadingUnixHTTPServer(unix_path, handler)
+    assert address is not None
+    return http.server.ThreadingHTTPServer(address, handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve OCR over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix", help="listen on a Unix socket instead")
+    parser.add_argument("--batch-window", type=float, default=0.01)
+    parser.add_argument("--max-batch-requests", type=int, default=16)
+    parser.add_argument("--max-batch-glyphs", type=int, default=64)
+    parser.add_argument(
+        "--batch-fit",
+        action="store_true",
+        help="coalesce requests whose geometries share a key; see --geometry-quantum",
+    )
+    parser.add_argument("--geometry-quantum", type=float, default=0.0)
+    parser.add_argument("--detect-workers", type=int)
+    parser.add_argument("--fit-workers", type=int)
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="solve the geometry strict and lax concurrently",
+    )
+    args = parser.parse_args()
+
+    service = OcrService(
+        batch_window=args.batch_window,
+        max_batch_requests=args.max_batch_requests,
+        max_batch_glyphs=args.max_batch_glyphs,
+        batch_fit=args.batch_fit,
+        geometry_quantum=args.geometry_quantum,
+        detect_workers=args.detect_workers,
+        fit_workers=args.fit_workers,
+        speculative=args.speculative,
+    )
+    server = make_server(service, (args.host, args.port), args.unix)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# synthetic Trunic pages with known glyph origins and strokes
+#
+# geometry is given like `findGlyphs` reports it (`geometry_prim`), in the
+# pipeline's upscaled pixels, so pages can be drawn with the geometry detected
+# from a real one. pages are drawn at that resolution then downsampled, so the
+# ground truth origins compare directly with `fitGlyphs` output
+
+import typing
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from . import (
+    NDArray_u8,
+    RecognizedGlyphPod,
+    make_glyph_geometry_from_prim,
+)
+
+GLYPH_STROKES = 12
+# roughly the proportions of the glyphs in the Tunic manual
+DEFAULT_GEOMETRY_PRIM = dict(
+    upscale=3,
+    stroke_width=8,
+    angle=30,
+    size=44.0,
+    upper=-1.5,
+    lower=6.0,
+    h_nudge=0.0,
+)
+
+
+@dataclass
+class SynthPage:
+    image: NDArray_u8
+    geometry_prim: dict
+    # in the same form as `fitGlyphs` output, reading order
+    glyphs: list[RecognizedGlyphPod]
+    line_glyph_counts: list[int]
+
+
+def random_strokes(rng: np.random.Generator, n: int) -> list[int]:
+    # every glyph has at least one stroke besides the baseline
+    return [int(v) for v in rng.integers(1, 1 << GLYPH_STROKES, n)]
+
+
+def random_words(
+    rng: np.random.Generator, n_glyphs: int, word_len=(1, 6)
+) -> list[list[int]]:
+    strokes = random_strokes(rng, n_glyphs)
+    words = []
+    while strokes:
+        n = int(rng.integers(word_len[0], word_len[1] + 1))
+        words.append(strokes[:n])
+        strokes = strokes[n:]
+    return words
+
+
+# each glyph is a 12-bit stroke set, bit `i` being stroke `i` of the templates.
+# words are wrapped into lines of at most `line_glyphs` glyphs; gaps and margins
+# are in glyph widths. `contrast` in (0, 1] scales the difference between ink
+# and paper; `noise` is the standard deviation of gaussian noise in gray levels
+def render_page(
+    words: typing.Sequence[typing.Sequence[int]],
+    geometry_prim: dict | None = None,
+    *,
+    line_glyphs=24,
+    word_gap=0.66,
+    line_gap=0.5,
+    margin=1.0,
+    contrast=1.0,
+    noise=0.0,
+    invert=False,
+    rng: np.random.Generator | None = None,
+) -> SynthPage:
+    prim = dict(DEFAULT_GEOMETRY_PRIM, **(geometry_prim or dict()))
+    g = make_glyph_geometry_from_prim(prim)
+    upscale = g.upscale
+    rng = rng if rng is not None else np.random.default_rng()
+
+    # lay out in upscaled pixels
+    margin_px = margin * g.glyph_width
+    line_height = g.glyph_template_shape[0] + line_gap * g.glyph_width
+    lines: list[list[tuple[float, list[int]]]] = [[]]
+    x = 0.0
+    for word in words:
+        if lines[-1] and x + len(word) * g.glyph_width > line_glyphs * g.glyph_width:
+            lines.append([])
+            x = 0.0
+        lines[-1].append((x, list(word)))
+        x += (len(word) + word_gap) * g.glyph_width
+
+    width = max(
+        (x0 + len(w) * g.glyph_width for line in lines for x0, w in line),
+        default=0,
+    )
+    shape = (
+        round((len(lines) * line_height + 2 * margin_px) / upscale) * upscale,
+        round((width + 2 * margin_px) / upscale) * upscale,
+    )
+    canvas = np.zeros(shape, dtype=np.uint8)
+
+    glyphs: list[RecognizedGlyphPod] = []
+    for line_i, line in enumerate(lines):
+        baseline_y = margin_px + line_i * line_height + g.glyph_template_origin[1]
+        for word_x, word in line:
+            for i, strokes in enumerate(word):
+                origin = np.array([margin_px + word_x + i * g.glyph_width, baseline_y])
+                draw_glyph(canvas, g, origin - g.glyph_template_origin, strokes)
+                glyphs.append(
+                    RecognizedGlyphPod(
+                        origin=tuple(map(int, np.rint(origin))),
+                        strokes=(strokes & 0xFF, strokes >> 8),
+                    )
+                )
+
+    ink = cv2.resize(
+        np.float32(canvas) / 255,
+        None,
+        None,
+        1 / upscale,
+        1 / upscale,
+        cv2.INTER_AREA,
+    )
+    paper_level, ink_level = 128 + 100 * contrast, 128 - 100 * contrast
+    if invert:
+        paper_level, ink_level = ink_level, paper_level
+    img = paper_level + (ink_level - paper_level) * ink
+    if noise > 0:
+        img += rng.normal(0, noise, img.shape)
+    img = np.uint8(np.clip(np.rint(img), 0, 255))
+
+    return SynthPage(
+        image=cv2.cvtColor(img, cv2.COLOR_GRAY2BGR),
+        geometry_prim=prim,
+        glyphs=glyphs,
+        line_glyph_counts=[sum(len(w) for _x, w in line) for line in lines],
+    )
+
+
+def random_page(
+    n_glyphs: int,
+    geometry_prim: dict | None = None,
+    *,
+    seed: int | None = None,
+    word_len=(1, 6),
+    **kwargs,
+) -> SynthPage:
+    rng = np.random.default_rng(seed)
+    return render_page(
+        random_words(rng, n_glyphs, word_len), geometry_prim, rng=rng, **kwargs
+    )
+
+
+# draws like `make_templates`, with the template origin at `offset`
+def draw_glyph(canvas: NDArray_u8, g, offset, strokes: int):
+    polylines = [
+        np.int32(2**16 * (line + offset))
+        for i, polyline in enumerate(g.all_lines)
+        if i == len(g.all_lines) - 1 or (i < GLYPH_STROKES and strokes >> i & 1)
+        for line in polyline
+    ]
+    cv2.polylines(
+        canvas,
+        polylines,
+        False,
+        255,
+        thickness=g.stroke_width,
+        lineType=cv2.LINE_AA,
+        shift=16,
+    )
+    if strokes >> (GLYPH_STROKES - 1) & 1:
+        cv2.circle(
+            canvas,
+            np.int32(2**16 * (g.circle_center + offset)),
+            2**16 * (g.stroke_width - 1),
+            255,
+            thickness=g.stroke_width - 1,
+            lineType=cv2.LINE_AA,
+            shift=16,
+        )